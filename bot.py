@@ -3,14 +3,17 @@
 # Modular — Shopping Cart + Escrow + Wallet + Chat + Stripe/Nets/PayNow
 # ==========================
 
-from datetime import time
+import time
+import asyncio
 import os
 import logging
 from dotenv import load_dotenv
 from telegram import Update, LabeledPrice, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest
 from telegram.ext import (
     ApplicationBuilder, CommandHandler, CallbackQueryHandler,
-    MessageHandler, ContextTypes, filters , PreCheckoutQueryHandler
+    MessageHandler, ContextTypes, filters , PreCheckoutQueryHandler,
+    AIORateLimiter,
 )
 
 # Load .env
@@ -18,6 +21,16 @@ load_dotenv()
 BOT_TOKEN = os.getenv("BOT_TOKEN", "")
 ADMIN_ID = int(os.getenv("ADMIN_ID", "0"))
 
+# Telegram Payments provider tokens (read once)
+PROVIDER_TOKEN_STRIPE       = os.getenv("PROVIDER_TOKEN_STRIPE")
+PROVIDER_TOKEN_SMART_GLOCAL = os.getenv("PROVIDER_TOKEN_SMART_GLOCAL")
+PROVIDER_TOKEN_REDSYS       = os.getenv("PROVIDER_TOKEN_REDSYS")
+PROVIDER_TOKENS = {
+    "smart_glocal": PROVIDER_TOKEN_SMART_GLOCAL,
+    "redsys": PROVIDER_TOKEN_REDSYS,
+    "stripe": PROVIDER_TOKEN_STRIPE,
+}
+
 # Modules
 # ==========================
 # MODULES IMPORT
@@ -86,7 +99,7 @@ async def handle_stripe_cart_checkout(update: Update, context: ContextTypes.DEFA
     user_id = update.effective_user.id
 
     # Provider token for Telegram Payments (Stripe)
-    token = os.getenv("PROVIDER_TOKEN_STRIPE")
+    token = PROVIDER_TOKEN_STRIPE
     if not token:
         return await query.answer("❌ Stripe provider token missing in .env", show_alert=True)
 
@@ -114,15 +127,14 @@ async def handle_stripe_cart_checkout(update: Update, context: ContextTypes.DEFA
 
     # Create child orders + reserve each item
     try:
+        prods = storage.get_seller_products_by_skus(cart)      # one read for the whole cart
         for sku, item in cart.items():
             qty = int(item.get("qty", 1))
             price = float(item.get("price", 0.0))
             amount = price * qty
 
-            seller_id = 0
-            sid, prod = storage.get_seller_product_by_sku(sku)
-            if prod:
-                seller_id = int(prod.get("seller_id", 0))
+            prod = prods.get(str(sku))
+            seller_id = int(prod.get("seller_id", 0)) if prod else 0
 
             child_id = storage.add_order(
                 buyer_id=user_id,
@@ -183,13 +195,7 @@ async def handle_native_checkout(update: Update, context: ContextTypes.DEFAULT_T
     if str(sku).strip().lower() == "cart":
         return await query.answer("Use cart checkout buttons.", show_alert=True)
 
-    tokens = {
-        "smart_glocal": os.getenv("PROVIDER_TOKEN_SMART_GLOCAL"),
-        "redsys": os.getenv("PROVIDER_TOKEN_REDSYS"),
-        "stripe": os.getenv("PROVIDER_TOKEN_STRIPE")
-    }
-
-    token = tokens.get(provider)
+    token = PROVIDER_TOKENS.get(provider)
     if not token:
         return await query.answer("❌ Payment provider not configured.", show_alert=True)
 
@@ -301,8 +307,8 @@ async def seller_ship_prompt(update: Update, context: ContextTypes.DEFAULT_TYPE,
 
 async def buyer_mark_received(update: Update, context: ContextTypes.DEFAULT_TYPE, order_id: str):
     q = update.callback_query
-    storage.update_order_status(order_id, "completed")
-    storage.update_order_meta(order_id, {"received_ts": int(time.time())})
+    # status + timestamp in one write
+    storage.update_order_status(order_id, "completed", received_ts=int(time.time()))
     await q.edit_message_text("✅ You confirmed delivery. Funds released to seller!")
 
 # --------------------------------------------------
@@ -310,12 +316,12 @@ async def buyer_mark_received(update: Update, context: ContextTypes.DEFAULT_TYPE
 # --------------------------------------------------
 async def handle_smart_glocal_cart(update: Update, context: ContextTypes.DEFAULT_TYPE, total: float):
     await _send_cart_invoice(update, context, total,
-                           os.getenv("PROVIDER_TOKEN_SMART_GLOCAL"),
+                           PROVIDER_TOKEN_SMART_GLOCAL,
                            "Smart Glocal")
 
 async def handle_redsys_cart(update: Update, context: ContextTypes.DEFAULT_TYPE, total: float):
     await _send_cart_invoice(update, context, total,
-                           os.getenv("PROVIDER_TOKEN_REDSYS"),
+                           PROVIDER_TOKEN_REDSYS,
                            "Redsys")
 
 async def _send_cart_invoice(update: Update, context: ContextTypes.DEFAULT_TYPE,
@@ -344,15 +350,14 @@ async def _send_cart_invoice(update: Update, context: ContextTypes.DEFAULT_TYPE,
     reserved_child_ids = []
 
     try:
+        prods = storage.get_seller_products_by_skus(cart)
         for sku, item in cart.items():
             qty   = int(item.get("qty", 1))
             price = float(item.get("price", 0.0))
             amount = price * qty
 
-            seller_id = 0
-            sid, prod = storage.get_seller_product_by_sku(sku)
-            if prod:
-                seller_id = int(prod.get("seller_id", 0))
+            prod = prods.get(str(sku))
+            seller_id = int(prod.get("seller_id", 0)) if prod else 0
 
             child_id = storage.add_order(
                 buyer_id=user_id,
@@ -393,6 +398,9 @@ async def _send_cart_invoice(update: Update, context: ContextTypes.DEFAULT_TYPE,
 # ==========================
 # CALLBACK ROUTER
 # ==========================
+# callbacks that go through ui.debounce_edit and replace their own queued edit
+_DEBOUNCED_CALLBACKS = ("shop_page:", "qty:")
+
 async def callback_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     q = update.callback_query
@@ -407,11 +415,16 @@ async def callback_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except:
         pass
 
+    # any other tap on a message supersedes a queued debounced edit of it, so
+    # a late page/qty render can't land on top of the screen this tap opens
+    if q.message is not None and not data.startswith(_DEBOUNCED_CALLBACKS):
+        ui.cancel_pending_edit((user_id, q.message.message_id))
+
     try:
         # Seller Ship Flow
             # ===== SELLER SHIP FLOW =====
         if data.startswith("seller:ship:"):
-            _, order_id = data.split(":", 1)
+            _, _, order_id = data.partition(":")
             return await seller_ship_prompt(update, context, order_id)
         # Redsys Cart Checkout and Smart Glocal Cart Checkout
         if data.startswith("redsys_cart:"):
@@ -424,22 +437,40 @@ async def callback_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         # ===== BUYER CONFIRM RECEIVED =====
         if data.startswith("order_complete:"):
-            _, order_id = data.split(":", 1)
+            _, _, order_id = data.partition(":")
             return await buyer_mark_received(update, context, order_id)
 
-        # MENUS
+        # ----- FOOTER FROM ORDERS SCREEN  -----
+        if data == "menu:orders:main":
+            kb, txt = ui.build_main_menu(storage.get_balance(user_id), user_id)
+            try:
+                await q.edit_message_text(txt, reply_markup=kb, parse_mode="Markdown")
+            except BadRequest as e:
+                if "not modified" in str(e).lower():   # already showing the menu
+                    return
+                # message gone / not editable → send fresh
+                await context.bot.send_message(user_id, txt, reply_markup=kb, parse_mode="Markdown")
+            return
+
+        # MENUS (exact matches above must stay ahead of this prefix route)
         if data.startswith("menu:"):
             return await ui.on_menu(update, context)
         
         # Shop Page
         if data.startswith("shop_page:"):
             page = int(data.split(":")[1])
-            txt, kb = ui.build_shop_keyboard(uid=user_id, page=page)
-            return await q.edit_message_text(
-                txt,
-                reply_markup=kb,
-                parse_mode="Markdown"
-            )
+
+            async def render_page():
+                txt, kb = ui.build_shop_keyboard(uid=user_id, page=page)
+                await q.edit_message_text(
+                    txt,
+                    reply_markup=kb,
+                    parse_mode="Markdown"
+                )
+
+            # only the last page of a tap burst gets built + sent
+            ui.debounce_edit((user_id, q.message.message_id), render_page)
+            return
         
                 # ----- ANALYTICS -----
 # 1. single-product analytics (MUST be first)
@@ -467,45 +498,29 @@ async def callback_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         # ORDER CANCEL (pending)
         if data.startswith("ordercancel:"):
-            _, oid = data.split(":", 1)
+            _, _, oid = data.partition(":")
             uid = update.effective_user.id
 
             ok, msg = storage.cancel_pending_order(oid, uid, grace_seconds=900)
             await q.answer(msg, show_alert=not ok)
 
-            # refresh Orders list by editing the same message
-            try:
-                await ui.on_menu(update, context)  # works because callback_data is still menu:orders in that message
-            except:
-                pass
-
-            # safest: force refresh by editing message to Orders screen directly
-            # (re-render orders screen using the same callback query)
-            q2 = update.callback_query
-            q2_data_backup = q2.data
-            try:
-                q2._data = "menu:orders"  # do NOT do this
-            except:
-                pass
-
-            # clean solution: call Orders renderer logic directly
-            # easiest approach: reuse ui.on_menu by calling a small helper instead (recommended below)
-
-            return await ui.on_menu(update, context)
+            # re-render Orders in place; q.data is the ordercancel callback,
+            # so name the tab explicitly
+            return await ui.on_menu(update, context, force_tab="orders")
         
         # ORDER ARCHIVE (per user)
         if data.startswith("orderarchive:"):
-            _, oid = data.split(":", 1)
+            _, _, oid = data.partition(":")
             uid = update.effective_user.id
             ok, msg = storage.archive_order_for_user(oid, uid)
             await q.answer(msg, show_alert=not ok)
-            return await ui.on_menu(update, context)
+            return await ui.on_menu(update, context, force_tab="orders")
 
         if data == "orderunarchiveall":
             uid = update.effective_user.id
             n = storage.unarchive_all_for_user(uid)
             await q.answer(f"Restored {n} order(s).", show_alert=False)
-            return await ui.on_menu(update, context)
+            return await ui.on_menu(update, context, force_tab="orders")
 
         # SEARCH
         if data == "shop:search":
@@ -524,8 +539,13 @@ async def callback_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return await ui.on_buy(update, context, sku, qty)
 
         if data.startswith("qty:"):
-            _, sku, qty = data.split(":")
-            return await ui.on_qty(update, context, sku, int(qty))
+            _, sku, shown, *step = data.split(":")
+            key = (user_id, q.message.message_id)
+            # −/+ are steps from the shown qty (cards sent before this carry an absolute qty)
+            qty = ui.step_pending_qty(key, int(shown), int(step[0])) if step else int(shown)
+            # rapid −/+ taps on one card: only the last qty gets rendered + edited
+            ui.debounce_edit(key, lambda: ui.on_qty(update, context, sku, qty))
+            return
 
         if data.startswith("checkout:"):
             _, sku, qty = data.split(":")
@@ -629,7 +649,8 @@ async def callback_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
             sol_needed = usd_val / sol_price
             
             user_wallet = wallet.ensure_user_wallet(user_id) 
-            balance = wallet.get_balance_devnet(user_wallet["public_key"])
+            # solana RPC is blocking HTTP → worker thread, keep the loop free
+            balance = await asyncio.to_thread(wallet.get_balance_devnet, user_wallet["public_key"])
             
             if balance < sol_needed:
                 return await q.answer(f"❌ Insufficient SOL. Need {sol_needed:.4f}", show_alert=True)
@@ -672,7 +693,7 @@ async def callback_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 cart_items = shopping_cart.get_cart(user_id)
                 if not cart_items:
                     return await q.edit_message_text("❌ Your cart is empty.")
-                first_item_sku = list(cart_items.keys())[0]
+                first_item_sku = next(iter(cart_items))          # first key, no full key list
             else:
                 first_item_sku = target_sku
 
@@ -689,7 +710,7 @@ async def callback_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
             # 3. Perform Transfer
             sol_amt = usd_amt / 150.0 
             user_wallet = wallet.ensure_user_wallet(user_id)
-            result = wallet.send_sol(user_wallet["private_key"], dest_addr, float(sol_amt))
+            result = await asyncio.to_thread(wallet.send_sol, user_wallet["private_key"], dest_addr, float(sol_amt))
             
             if isinstance(result, dict) and "error" in result:
                 return await q.edit_message_text(f"❌ Transaction Failed: {result['error']}")
@@ -700,16 +721,15 @@ async def callback_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
             
             storage.add_order(user_id, f"Direct: {first_item_sku}", 1, usd_amt, "Solana", seller_id)
             
-            kb_back = InlineKeyboardMarkup([[InlineKeyboardButton("🏠 Home", callback_data="menu:main")]])
             return await q.edit_message_text(f"✅ *Payment Sent!*\n\nID: `{result}`", 
-                                     parse_mode="Markdown", reply_markup=kb_back)
+                                     parse_mode="Markdown", reply_markup=ui.KB_JUST_HOME)
 
         # ESCROW SYSTEM
         if data.startswith("payconfirm:"):
-            return await ui.handle_pay_confirm(update, context, data.split(":",1)[1])
+            return await ui.handle_pay_confirm(update, context, data.partition(":")[2])
 
         if data.startswith("paycancel:"):
-            return await ui.handle_pay_cancel(update, context, data.split(":",1)[1])
+            return await ui.handle_pay_cancel(update, context, data.partition(":")[2])
 
         # SELLER
         if data.startswith("sell:list"):
@@ -736,16 +756,6 @@ async def callback_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
             else:
                 return await q.answer("❌ Wrong answer", show_alert=True)
 
-        # ----- FOOTER FROM ORDERS SCREEN  -----
-        if data == "menu:orders:main":
-            await q.answer()
-            kb, txt = ui.build_main_menu(storage.get_balance(user_id), user_id)
-            try:
-                await q.edit_message_text(txt, reply_markup=kb, parse_mode="Markdown")
-            except Exception:                      # message gone → send fresh
-                await context.bot.send_message(user_id, txt, reply_markup=kb, parse_mode="Markdown")
-            return
-
         # CHAT
         if data.startswith("contact:"):
             _, sku, sid = data.split(":")
@@ -753,7 +763,7 @@ async def callback_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
                 # ----- ORDER-RELATED CHAT -----
         if data.startswith("chat:order:"):
-            _, order_id = data.split(":", 1)
+            _, _, order_id = data.partition(":")
             return await chat.on_chat_from_order(update, context, order_id)
 
         if data.startswith("chat:open:"):
@@ -782,7 +792,7 @@ async def callback_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         # ADMIN
         if data == "admin:disputes":
-            return await ui.admin_open_disputes(update, context)
+            return await ui.admin_dispute_dashboard(update, context)
 
         if data.startswith("admin_refund:"):
             oid = data.split(":")[1]
@@ -863,13 +873,13 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         storage.user_flow_state.pop(user_id, None)
 
         kb = InlineKeyboardMarkup([
-            [InlineKeyboardButton("🏠 Main Menu", callback_data="menu:main")],
+            [ui.BTN_HOME],
             [InlineKeyboardButton("🛍 Marketplace", callback_data="menu:shop")],
         ])
 
         await msg.reply_text(
             f"✅ *Listing Added!*\n\n"
-            f"• *Title:* {title}\n"
+            f"• *Title:* {ui.md_escape(title)}\n"
             f"• *Price:* ${price:.2f}\n"
             f"• *Stock:* {qty}\n"
             f"• *SKU:* `{sku}`" + ("\n• *Image attached*" if image_url else ""),
@@ -880,6 +890,33 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if wallet.is_in_withdraw_flow(uid):
         return await wallet.handle_withdraw_flow(update, context, text)
 
+# ==========================
+# BACKGROUND SNAPSHOTS
+# ==========================
+SNAPSHOT_REFRESH_S = 2.0
+
+async def _snapshot_refresher():
+    """Keep product/thread caches warm so callbacks never parse JSON inline."""
+    while True:
+        try:
+            # only the file reads/parses run in the worker; every cache is
+            # swapped on the loop, where writers run
+            snaps = await asyncio.to_thread(storage.read_snapshots)
+            storage.publish_snapshots(snaps)
+            ui.enumerate_all_products()          # in-memory rebuild only, stays on the loop
+        except Exception:
+            logger.exception("snapshot refresh failed")
+        await asyncio.sleep(SNAPSHOT_REFRESH_S)
+
+async def _post_init(app):
+    app.bot_data["snapshot_task"] = asyncio.create_task(_snapshot_refresher())
+
+async def _post_stop(app):
+    task = app.bot_data.pop("snapshot_task", None)
+    if task:
+        task.cancel()
+    await ui.close_http()
+
 # ==========================
 # MAIN
 # ==========================
@@ -890,7 +927,17 @@ def main():
     
     storage.seed_builtin_products_once()
 
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
+    app = (
+        ApplicationBuilder()
+        .token(BOT_TOKEN)
+        # every outgoing bot call (sends, edits, fan-outs) is paced under
+        # Telegram's 30/s global and per-chat limits; one RetryAfter is
+        # waited out and retried instead of surfacing as an error
+        .rate_limiter(AIORateLimiter(max_retries=1))
+        .post_init(_post_init)
+        .post_stop(_post_stop)
+        .build()
+    )
 
     # Mandatory Payment Logic Handlers (Pre-checkout and Success)
     app.add_handler(PreCheckoutQueryHandler(precheckout_callback))
@@ -0,0 +1,12 @@
+import sys
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+# ===========================
+# SHARED STATIC BUTTONS
+# ===========================
+# leaf module: imports nothing from modules/, so ui, chat, seller,
+# shopping_cart and wallet_utils can all share these without import cycles
+CB_MENU_MAIN = sys.intern("menu:main")
+
+BTN_HOME     = InlineKeyboardButton("🏠 Home", callback_data=CB_MENU_MAIN)
+KB_JUST_HOME = InlineKeyboardMarkup([[BTN_HOME]])
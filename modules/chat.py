@@ -4,6 +4,7 @@ from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.constants import ParseMode, ChatAction
 from telegram.ext import ContextTypes
 from modules import storage
+from modules.buttons import BTN_HOME
 
 # State tracking
 rate_limit = {}
@@ -61,7 +62,7 @@ async def on_contact_seller(update: Update, context: ContextTypes.DEFAULT_TYPE,
     buyer = update.effective_user
     buyer_id = buyer.id
 
-    from modules.ui import get_any_product_by_sku
+    from modules.ui import get_any_product_by_sku, md_escape
     product = get_any_product_by_sku(sku)
     if not product:
         await q.answer("Item not found.", show_alert=True)
@@ -72,7 +73,7 @@ async def on_contact_seller(update: Update, context: ContextTypes.DEFAULT_TYPE,
 
     kb = InlineKeyboardMarkup([
         [InlineKeyboardButton("💬 Open Chat", callback_data=f"chat:open:{thread_id}")],
-        [InlineKeyboardButton("🏠 Menu", callback_data="menu:main")]
+        [BTN_HOME]
     ])
 
     await q.edit_message_text(
@@ -85,13 +86,13 @@ async def on_contact_seller(update: Update, context: ContextTypes.DEFAULT_TYPE,
     try:
         await smart_send(
             context, seller_id,
-            f"📩 *New Buyer Alert!*\n{buyer.first_name} wants to chat about *{product['name']}!*"
+            f"📩 *New Buyer Alert!*\n{md_escape(buyer.first_name)} wants to chat about *{product['name']}!*"
         )
     except Exception:
         # Seller hasn't started bot yet
         storage.add_pending_notification(
             seller_id,
-            f"🕓 *Missed Message*\n{buyer.first_name} wanted to chat about *{product['name']}*.\n"
+            f"🕓 *Missed Message*\n{md_escape(buyer.first_name)} wanted to chat about *{product['name']}*.\n"
             f"You can reply once you open the bot."
         )
         await q.message.reply_text(
@@ -107,6 +108,8 @@ async def on_chat_user(update: Update, context: ContextTypes.DEFAULT_TYPE, targe
     if sender_id == target_id:
         return await q.answer("You cannot message yourself.", show_alert=True)
 
+    from modules.ui import md_escape
+
     # reuse thread model, but no product
     product = {"sku": "user_chat", "name": "Direct Message", "price": 0}
 
@@ -115,7 +118,7 @@ async def on_chat_user(update: Update, context: ContextTypes.DEFAULT_TYPE, targe
 
     kb = InlineKeyboardMarkup([
         [InlineKeyboardButton("💬 Open Chat", callback_data=f"chat:open:{thread_id}")],
-        [InlineKeyboardButton("🏠 Menu", callback_data="menu:main")]
+        [BTN_HOME]
     ])
 
     await q.edit_message_text(
@@ -125,9 +128,9 @@ async def on_chat_user(update: Update, context: ContextTypes.DEFAULT_TYPE, targe
     )
 
     try:
-        await smart_send(context, target_id, f"📩 *New Message*\n{sender.first_name} wants to chat with you.")
+        await smart_send(context, target_id, f"📩 *New Message*\n{md_escape(sender.first_name)} wants to chat with you.")
     except Exception:
-        storage.add_pending_notification(target_id, f"🕓 *Missed Message*\n{sender.first_name} tried to message you.")
+        storage.add_pending_notification(target_id, f"🕓 *Missed Message*\n{md_escape(sender.first_name)} tried to message you.")
 
 async def on_chat_open(update: Update, context: ContextTypes.DEFAULT_TYPE, thread_id: str):
     q = update.callback_query
@@ -153,7 +156,7 @@ async def on_chat_open(update: Update, context: ContextTypes.DEFAULT_TYPE, threa
 
     kb = InlineKeyboardMarkup([
         [InlineKeyboardButton("🚪 Exit Chat", callback_data="chat:exit")],
-        [InlineKeyboardButton("🏠 Menu", callback_data="menu:main")]
+        [BTN_HOME]
     ])
 
     await q.edit_message_text(
@@ -206,9 +209,10 @@ async def handle_private_message(update: Update, context: ContextTypes.DEFAULT_T
 
     except Exception:
         # If receiver hasn't started the bot
+        from modules.ui import md_escape
         storage.add_pending_notification(
             other_id,
-            f"📨 *Offline Message*\n{user_name} sent:\n> {text}"
+            f"📨 *Offline Message*\n{md_escape(user_name)} sent:\n> {text}"
         )
         await msg.reply_text(
             "🕓 The user is offline. I’ll deliver your message once they come online.",
@@ -221,15 +225,14 @@ async def on_chat_exit(update: Update, context: ContextTypes.DEFAULT_TYPE):
     storage.active_private_chats.pop(uid, None)
     if uid in storage.active_public_chat:
         storage.active_public_chat.remove(uid)
-        for other_id in list(storage.active_public_chat):
-            try:
-                await context.bot.send_message(
-                    other_id,
-                    f"👋 A user has left the public chat.",
-                    parse_mode=ParseMode.MARKDOWN
-                )
-            except:
-                pass
+        # fan out concurrently; one blocked/dead chat shouldn't stall the rest
+        await asyncio.gather(*(
+            context.bot.send_message(
+                other_id,
+                "👋 A user has left the public chat."
+            )
+            for other_id in list(storage.active_public_chat)
+        ), return_exceptions=True)
     await q.edit_message_text("🚪 Chat closed. Type /start to return to menu.")
 
 # ----------------- Public Chat -----------------
@@ -240,20 +243,18 @@ async def on_public_chat_open(update: Update, context: ContextTypes.DEFAULT_TYPE
 
     if uid not in storage.active_public_chat:
         storage.active_public_chat.add(uid)
-        for other_id in list(storage.active_public_chat):
-            if other_id != uid:
-                try:
-                    await context.bot.send_message(
-                        other_id, f"🔔 *{name}* joined the chat!",
-                        parse_mode=ParseMode.MARKDOWN
-                    )
-                except Exception:
-                    pass
+        await asyncio.gather(*(
+            context.bot.send_message(
+                other_id, f"🔔 *{name}* joined the chat!",
+                parse_mode=ParseMode.MARKDOWN
+            )
+            for other_id in list(storage.active_public_chat) if other_id != uid
+        ), return_exceptions=True)
 
     storage.active_private_chats.pop(uid, None)
     kb = InlineKeyboardMarkup([
         [InlineKeyboardButton("🚪 Exit Chat", callback_data="chat:exit")],
-        [InlineKeyboardButton("🏠 Menu", callback_data="menu:main")]
+        [BTN_HOME]
     ])
     await q.edit_message_text(
         "🌐 *Public Chat Room*\nChat with anyone using this bot. Be respectful.\nType your message below:",
@@ -261,6 +262,10 @@ async def on_public_chat_open(update: Update, context: ContextTypes.DEFAULT_TYPE
         reply_markup=kb
     )
 
+_KB_PUBLIC_EXIT = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🚪 Exit Chat", callback_data="chat:exit")]
+])
+
 async def handle_public_message(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str):
     uid = update.effective_user.id
     msg = update.effective_message
@@ -271,22 +276,21 @@ async def handle_public_message(update: Update, context: ContextTypes.DEFAULT_TY
         return
     rate_limit[uid] = time.time()
 
-    for other_id in list(storage.active_public_chat):
-        if other_id == uid:
-            continue
+    body = f"💭 *{user_name}*: {text}"
+
+    async def relay(other_id):
         asyncio.create_task(show_typing_indicator(context, other_id, user_name))
-        try:
-            await send_typing_action(context, other_id, text)
-            await context.bot.send_message(
-                other_id,
-                f"💭 *{user_name}*: {text}",
-                parse_mode=ParseMode.MARKDOWN,
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("🚪 Exit Chat", callback_data="chat:exit")]
-                ])
-            )
-        except Exception:
-            pass
+        await send_typing_action(context, other_id, text)
+        await context.bot.send_message(
+            other_id, body, parse_mode=ParseMode.MARKDOWN, reply_markup=_KB_PUBLIC_EXIT
+        )
+
+    # every recipient's typing delay + send runs at once, so the room gets the
+    # message after one typing pause instead of one pause per member
+    await asyncio.gather(*(
+        relay(other_id)
+        for other_id in list(storage.active_public_chat) if other_id != uid
+    ), return_exceptions=True)
 
 # ----------------- Message Deletion (Hiding) -----------------
 async def on_chat_delete(update: Update, context: ContextTypes.DEFAULT_TYPE, thread_id: str):
@@ -350,7 +354,7 @@ async def on_chat_from_order(update: Update, context: ContextTypes.DEFAULT_TYPE,
 
     kb = InlineKeyboardMarkup([
         [InlineKeyboardButton("💬 Open Chat", callback_data=f"chat:open:{thread_id}")],
-        [InlineKeyboardButton("🏠 Menu", callback_data="menu:main")]
+        [BTN_HOME]
     ])
 
     await q.edit_message_text(
@@ -59,11 +59,7 @@ def _save(d):
     storage.save_json(storage.SELLER_PRODUCTS_FILE, d)
 
 def _find_product_mut(data, sku):
-    for items in data.values():
-        for p in items:
-            if str(p.get("sku")) == sku:
-                return p
-    return None
+    return storage.find_product_mut(data, sku)
 
 def _ensure_fields(p):
     p.setdefault("stock", 0)
@@ -115,25 +111,33 @@ def _find_variant_mut(p, var_id):
 # Availability
 # -------------------------
 
-def get_available_stock(sku: str) -> Optional[int]:
+def _available_in(index, sku: str) -> Optional[int]:
     base, var = split_sku_variant(sku)
     if not base:
         return None
 
-    data = _load()
-    p = _find_product_mut(data, base)
-    if not p:
+    hit = index.get(base)
+    if not hit:
         return None
-
-    _ensure_fields(p)
+    p = hit[1]
 
     if var:
-        v = _find_variant_mut(p, var)
+        v = next((v for v in p.get("variations", []) if str(v.get("id")) == str(var)), None)
         if not v:
             return 0
-        return max(0, int(v["stock"]) - int(v["reserved"]))
+        return max(0, int(v.get("stock", 0)) - int(v.get("reserved", 0)))
+
+    return max(0, int(p.get("stock", 0)) - int(p.get("reserved", 0)))
+
+def get_available_stock(sku: str) -> Optional[int]:
+    # read-only path: O(1) lookup in storage's cached sku index, no parse,
+    # no mutation of the shared product dicts
+    return _available_in(storage.load_products_index(), sku)
 
-    return max(0, int(p["stock"]) - int(p["reserved"]))
+def get_available_stock_bulk(skus) -> dict[str, Optional[int]]:
+    """{sku: available} for many skus against one index snapshot (one stat, at most one parse)."""
+    index = storage.load_products_index()
+    return {str(sku): _available_in(index, str(sku)) for sku in skus}
 
 def check_available(sku: str, qty: int):
     # Contract: returns (bool, int)
@@ -212,6 +216,9 @@ def confirm_payment(order_id: str):
     o = _get_order(order_id)
     if not o:
         return False, "Order not found"
+    # cart reservations (reserve_cart_for_payment) carry inv_items, no sku
+    if o.get("inv_mode") == "cart":
+        return confirm_cart_payment(order_id)
     if o.get("inv_deducted"):
         return True, "ok"
 
@@ -268,6 +275,8 @@ def release_on_failure_or_refund(order_id: str, reason="failed"):
     o = _get_order(order_id)
     if not o:
         return False, "Order not found"
+    if o.get("inv_mode") == "cart":
+        return release_cart_on_failure_or_refund(order_id, reason)
 
     sku = o.get("sku")
 
@@ -332,6 +341,7 @@ def reserve_cart_for_payment(order_id: str, items: list[dict]):
 
     with FileLock(_LOCK_PATH):
         data = _load()
+        rows = storage.product_rows_mut(data)      # several skus: index the fresh data once
 
         # 1) Check all availability first
         for it in norm_items:
@@ -339,7 +349,7 @@ def reserve_cart_for_payment(order_id: str, items: list[dict]):
             if not base:
                 return False, f"Invalid SKU: {it['sku']}"
 
-            p = _find_product_mut(data, base)
+            p = rows.get(base)
             if not p:
                 return False, f"Product not found: {base}"
 
@@ -360,7 +370,7 @@ def reserve_cart_for_payment(order_id: str, items: list[dict]):
         # 2) Reserve all
         for it in norm_items:
             base, var = split_sku_variant(it["sku"])
-            p = _find_product_mut(data, base)
+            p = rows.get(base)
             _ensure_fields(p)
 
             if var:
@@ -399,6 +409,7 @@ def confirm_cart_payment(order_id: str):
 
     with FileLock(_LOCK_PATH):
         data = _load()
+        rows = storage.product_rows_mut(data)
 
         # Validate reservations exist
         for it in items:
@@ -410,7 +421,7 @@ def confirm_cart_payment(order_id: str):
             if not base:
                 return False, f"Invalid SKU: {sku}"
 
-            p = _find_product_mut(data, base)
+            p = rows.get(base)
             if not p:
                 return False, f"Product not found: {base}"
             _ensure_fields(p)
@@ -434,7 +445,7 @@ def confirm_cart_payment(order_id: str):
             qty = max(1, qty)
 
             base, var = split_sku_variant(sku)
-            p = _find_product_mut(data, base)
+            p = rows.get(base)
             _ensure_fields(p)
 
             if var:
@@ -470,6 +481,7 @@ def release_cart_on_failure_or_refund(order_id: str, reason: str = "failed"):
 
     with FileLock(_LOCK_PATH):
         data = _load()
+        rows = storage.product_rows_mut(data)
 
         for it in items:
             sku = str(it.get("sku", "")).strip()
@@ -480,7 +492,7 @@ def release_cart_on_failure_or_refund(order_id: str, reason: str = "failed"):
             if not base:
                 continue
 
-            p = _find_product_mut(data, base)
+            p = rows.get(base)
             if not p:
                 continue
             _ensure_fields(p)
@@ -2,19 +2,22 @@ from asyncio.log import logger
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.constants import ParseMode
 from telegram import Update
-from telegram.error import BadRequest 
-from telegram.ext import ContextTypes
-from telegram.error import BadRequest 
+from telegram.error import BadRequest
 from telegram.ext import ContextTypes
 from modules import shopping_cart, storage
+from modules.buttons import CB_MENU_MAIN, BTN_HOME, KB_JUST_HOME
 
 import datetime as _dt
+import math
+from functools import lru_cache
 
 # ==========================
 # SELLER MENU
 # ==========================
 
+@lru_cache(maxsize=8)
 def build_seller_menu(role: str):
+    """Pure in role → cached; callers get a shared (text, markup) pair."""
     if role != "seller":
         text = (
             "🛠 *Seller Center*\n\n"
@@ -23,7 +26,7 @@ def build_seller_menu(role: str):
         )
         kb = InlineKeyboardMarkup([
             [InlineKeyboardButton("✅ Register as Seller", callback_data="sell:register")],
-            [InlineKeyboardButton("🏠 Menu", callback_data="menu:main")]
+            [BTN_HOME]
         ])
     else:
         text = (
@@ -35,7 +38,7 @@ def build_seller_menu(role: str):
             [InlineKeyboardButton("📄 My Listings", callback_data="sell:list"),
             InlineKeyboardButton("✏ Update Stock", callback_data="sell:pick_stock")],   # <-- NEW
             [InlineKeyboardButton("📈 Analytics", callback_data="analytics:30")],
-            [InlineKeyboardButton("🏠 Menu", callback_data="menu:main")]
+            [BTN_HOME]
         ])
 
     return text, kb
@@ -99,9 +102,7 @@ async def show_seller_listings(update, context):
         return await q.edit_message_text(
             "📄 *My Listings*\n\nYou have no active listings.",
             parse_mode=ParseMode.MARKDOWN,
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("🏠 Menu", callback_data="menu:main")]
-            ])
+            reply_markup=KB_JUST_HOME
         )
 
     rows = []                       # ← initialise list
@@ -115,7 +116,7 @@ async def show_seller_listings(update, context):
             InlineKeyboardButton("🗑 Remove", callback_data=f"sell:remove_confirm:{p['sku']}")
         ])
 
-    rows.append([InlineKeyboardButton("🏠 Menu", callback_data="menu:main")])
+    rows.append([BTN_HOME])
 
     await q.edit_message_text(
         "📄 *My Listings*\n\nTap ✏ to change stock or 🗑 to remove:",
@@ -127,22 +128,33 @@ async def show_seller_listings(update, context):
 # Analytics for Seller
 # ==========================
 
+# many-field panels: one %-template, formatted in a single C-level pass
+_ANALYTICS_TMPL = (
+    "📈 *Seller Analytics*  –  %(period)s\n\n"
+    "• *Active listings:* %(active)s\n"
+    "• *Total orders:* %(orders)s\n"
+    "• *Completed:* %(completed)s\n"
+    "• *Conversion:* %(conv_rate)s %%\n"
+    "• *Units sold:* %(units)s\n"
+    "• *Revenue:* $%(revenue).2f\n"
+    "• *Top SKU:* `%(top_sku)s`"
+)
+
+_PRODUCT_ANALYTICS_TMPL = (
+    "📈 *Product Analytics* – `%s`\n\n"
+    "📦 *Name:* %s\n"
+    "💰 *Revenue:* $%.2f\n"
+    "📦 *Units Sold:* %s\n"
+    "📊 *Completed Orders:* %s"
+)
+
 async def show_analytics(update, context, days: int = 30):
     q = update.callback_query
     seller_uid = update.effective_user.id
 
     data = _seller_analytics(seller_uid, days)
 
-    text = (
-        f"📈 *Seller Analytics*  –  {data['period']}\n\n"
-        f"• *Active listings:* {data['active']}\n"
-        f"• *Total orders:* {data['orders']}\n"
-        f"• *Completed:* {data['completed']}\n"
-        f"• *Conversion:* {data['conv_rate']} %\n"
-        f"• *Units sold:* {data['units']}\n"
-        f"• *Revenue:* ${data['revenue']:.2f}\n"
-        f"• *Top SKU:* `{data['top_sku'] or 'N/A'}`"
-    )
+    text = _ANALYTICS_TMPL % data
 
     try:
         await q.edit_message_text(text, parse_mode=ParseMode.MARKDOWN,
@@ -151,8 +163,7 @@ async def show_analytics(update, context, days: int = 30):
         if "message is not modified" in str(e).lower():
             await q.answer()          # acknowledge silently
         else:
-            raise 
-                            # real error, re-raise
+            raise                     # real error, re-raise
 
 # ==========================
 # Update Stock
@@ -191,7 +202,7 @@ async def prompt_update_stock(update: Update, context: ContextTypes.DEFAULT_TYPE
         f"📦 Send the *new stock quantity* for `{prod['name']}`:",
         parse_mode=ParseMode.MARKDOWN,
         reply_markup=InlineKeyboardMarkup([[
-            InlineKeyboardButton("❌ Cancel", callback_data="menu:main")
+            InlineKeyboardButton("❌ Cancel", callback_data=CB_MENU_MAIN)
         ]])
     )
 
@@ -224,9 +235,7 @@ async def do_remove_listing(update, context, sku: str):
 
     await q.edit_message_text(
         msg,
-        reply_markup=InlineKeyboardMarkup([
-            [InlineKeyboardButton("🏠 Menu", callback_data="menu:main")]
-        ])
+        reply_markup=KB_JUST_HOME
     )
 # ==========================
 # Analytical
@@ -244,20 +253,26 @@ async def show_single_product_analytics(update, context, sku: str):
 
     item = shopping_cart.get_any_product_by_sku(sku) or {}
 
-    text = (
-        f"📈 *Product Analytics* – `{sku}`\n\n"
-        f"📦 *Name:* {item.get('name', sku)}\n"
-        f"💰 *Revenue:* ${revenue:.2f}\n"
-        f"📦 *Units Sold:* {units}\n"
-        f"📊 *Completed Orders:* {len(completed)}"
-    )
+    text = _PRODUCT_ANALYTICS_TMPL % (sku, item.get("name", sku), revenue, units, len(completed))
 
     kb = InlineKeyboardMarkup([[
         InlineKeyboardButton("🔙 Back to Item", callback_data=f"view_item:{sku}"),
-        InlineKeyboardButton("🏠 Main Menu", callback_data="menu:main")
+        BTN_HOME
     ]])
 
-    await q.edit_message_text(text, parse_mode=ParseMode.MARKDOWN, reply_markup=kb)
+    try:
+        await q.edit_message_text(text, parse_mode=ParseMode.MARKDOWN, reply_markup=kb)
+    except BadRequest as e:
+        # opened from a photo card → nothing to edit, send a fresh message
+        if "no text in the message" in str(e).lower():
+            await context.bot.send_message(
+                chat_id=q.message.chat.id,
+                text=text,
+                parse_mode=ParseMode.MARKDOWN,
+                reply_markup=kb
+            )
+        else:
+            raise
 
 # ==========================
 # ADD LISTING FLOW
@@ -299,7 +314,7 @@ async def handle_seller_flow(update: Update, context: ContextTypes.DEFAULT_TYPE,
     if st["phase"] == "add_price":
         try:
             price = float(text)
-            if price <= 0:
+            if not math.isfinite(price) or price <= 0:     # float() accepts "inf"/"nan"
                 raise ValueError
         except ValueError:
             return await msg.reply_text("❌ Invalid price. Please send a number.")
@@ -338,7 +353,7 @@ async def handle_seller_flow(update: Update, context: ContextTypes.DEFAULT_TYPE,
         storage.user_flow_state.pop(user_id, None)          # clear state
 
         kb = InlineKeyboardMarkup([[
-            InlineKeyboardButton("🏠 Main Menu", callback_data="menu:main")
+            BTN_HOME
         ]])
         await msg.reply_text(
             f"✅ *Stock updated*\n\n"
@@ -368,13 +383,14 @@ async def handle_seller_flow(update: Update, context: ContextTypes.DEFAULT_TYPE,
             return
 
         storage.user_flow_state.pop(user_id, None)
+        from modules import ui                    # lazy: ui imports seller
         kb = InlineKeyboardMarkup([
-            [InlineKeyboardButton("🏠 Main Menu", callback_data="menu:main")],
+            [BTN_HOME],
             [InlineKeyboardButton("🛍 Marketplace", callback_data="menu:shop")]
         ])
         await msg.reply_text(
             f"✅ *Listing Added!*\n\n"
-            f"• *Title:* {title}\n"
+            f"• *Title:* {ui.md_escape(title)}\n"
             f"• *Price:* ${price:.2f}\n"
             f"• *Stock:* {qty}\n"
             f"• *SKU:* `{sku}`" + ("\n• *Image attached*" if image_url else ""),
@@ -444,7 +460,7 @@ def _seller_analytics(seller_uid: int, days: int = 30):
         "revenue"  : revenue,
         "units"    : units,
         "conv_rate": round(len(completed) / len(orders) * 100, 1) if orders else 0,
-        "top_sku"  : top_sku,
+        "top_sku"  : top_sku or "N/A",
         "active"   : len(listings)
     }
 
@@ -455,69 +471,3 @@ def _analytics_kb():
          InlineKeyboardButton("📊 All-time", callback_data="analytics:0")],
         [InlineKeyboardButton("🏠 Seller Center", callback_data="menu:sell")]
     ])
-
-# --------------------------------------------------
-#  ANALYTICS 
-# --------------------------------------------------
-
-async def show_analytics(update, context, days: int = 30):
-    """Callback: display analytics panel."""
-    q = update.callback_query
-    seller_uid = update.effective_user.id
-
-    data = _seller_analytics(seller_uid, days)
-
-    text = (
-        f"📈 *Seller Analytics*  –  {data['period']}\n\n"
-        f"• *Active listings:* {data['active']}\n"
-        f"• *Total orders:* {data['orders']}\n"
-        f"• *Completed:* {data['completed']}\n"
-        f"• *Conversion:* {data['conv_rate']} %\n"
-        f"• *Units sold:* {data['units']}\n"
-        f"• *Revenue:* ${data['revenue']:.2f}\n"
-        f"• *Top SKU:* `{data['top_sku'] or 'N/A'}`"
-    )
-
-    await q.edit_message_text(text, parse_mode=ParseMode.MARKDOWN,
-                              reply_markup=_analytics_kb())
-    
-
-
-async def show_single_product_analytics(update, context, sku: str):
-    q = update.callback_query
-    seller_uid = update.effective_user.id
-
-    # build stats 
-    orders = storage.get_seller_orders_since(seller_uid, _dt.date.min)
-    completed = [o for o in orders if o.get("status") == "completed" and o.get("sku") == sku]
-    revenue = sum(float(o["total"]) for o in completed)
-    units   = sum(int(o["qty"]) for o in completed)
-    item = shopping_cart.get_any_product_by_sku(sku) or {}
-
-    #  define text BEFORE using it 
-    text = (
-        f"📈 *Product Analytics* – `{sku}`\n\n"
-        f"📦 *Name:* {item.get('name', sku)}\n"
-        f"💰 *Revenue:* ${revenue:.2f}\n"
-        f"📦 *Units Sold:* {units}\n"
-        f"📊 *Completed Orders:* {len(completed)}"
-    )
-
-    kb = InlineKeyboardMarkup([[
-        InlineKeyboardButton("🔙 Back to Item", callback_data=f"view_item:{sku}"),
-        InlineKeyboardButton("🏠 Main Menu", callback_data="menu:main")
-    ]])
-
-    # send / edit 
-    try:
-        await q.edit_message_text(text, parse_mode=ParseMode.MARKDOWN, reply_markup=kb)
-    except BadRequest as e:
-        if "no text in the message" in str(e).lower():
-            await context.bot.send_message(
-                chat_id=q.message.chat.id,
-                text=text,
-                parse_mode=ParseMode.MARKDOWN,
-                reply_markup=kb
-            )
-        else:
-            raise
\ No newline at end of file
@@ -3,16 +3,26 @@
 # ==========================================
 
 import json
+import math
 import os
+from concurrent.futures import ThreadPoolExecutor
 from modules import inventory
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest
 from modules import storage
+from modules.buttons import BTN_HOME
 from typing import Optional
 
 
 CART_FILE = storage.CART_FILE
 SELLER_PRODUCTS_FILE = storage.SELLER_PRODUCTS_FILE
 
+# empty/cleared cart keyboard, built once
+_KB_EMPTY_CART = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🛍 Shop", callback_data="menu:shop")],
+    [BTN_HOME]
+])
+
 
 # ------------------------------------------
 # BUILT-IN PRODUCTS
@@ -29,30 +39,39 @@ def load_all_products(viewer_id: Optional[int] = None):
     If viewer_id is supplied, adds 'is_own' flag so UI can hide buy buttons.
     """
     products = dict(BUILTIN_PRODUCTS)
-    if os.path.exists(SELLER_PRODUCTS_FILE):
+    # mtime-cached parse shared with storage/ui → treat the rows as read-only
+    seller_data = storage.load_json_cached(SELLER_PRODUCTS_FILE)
+    for seller_id_str, items in seller_data.items():
         try:
-            with open(SELLER_PRODUCTS_FILE, "r", encoding="utf-8") as f:
-                seller_data = json.load(f)
-                for seller_id_str, items in seller_data.items():
-                    for it in items:
-                        if "sku" in it:
-                            # flag own listings
-                            if viewer_id is not None and int(seller_id_str) == viewer_id:
-                                it = dict(it)          # do not mutate original
-                                it["is_own"] = True
-                            products[it["sku"]] = it
-        except Exception:
-            pass
+            own = viewer_id is not None and int(seller_id_str) == viewer_id
+        except ValueError:
+            own = False
+        for it in items:
+            if "sku" in it:
+                # flag own listings
+                if own:
+                    it = dict(it)          # do not mutate original
+                    it["is_own"] = True
+                products[it["sku"]] = it
     return products
 
 def get_any_product_by_sku(sku):
-    return load_all_products().get(sku)
+    # single lookup: no need to materialise the whole catalog dict.
+    # seller listings win over built-ins, same as load_all_products()
+    hit = storage.load_products_index().get(str(sku))
+    return hit[1] if hit else BUILTIN_PRODUCTS.get(sku)
 
 
 # ------------------------------------------
 # CART STORAGE
 # ------------------------------------------
-def load_cart():
+# cart.json is only touched through this module, so keep it in memory:
+# reads never hit disk after the first, writes are write-behind on a
+# single worker (one thread → file writes land in call order).
+_CART_DB = None
+_CART_WRITER = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cart-writer")
+
+def _read_cart_file():
     if not os.path.exists(CART_FILE):
         return {}
     try:
@@ -62,13 +81,44 @@ def load_cart():
     except:
         return {}
 
-def save_cart(data):
+def _write_cart_file(payload: str):
     os.makedirs(os.path.dirname(CART_FILE), exist_ok=True)
-    with open(CART_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2)
+    tmp = CART_FILE + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(payload)
+    os.replace(tmp, CART_FILE)
+
+def load_cart():
+    global _CART_DB
+    if _CART_DB is None:
+        _CART_DB = _read_cart_file()
+    return _CART_DB
+
+def save_cart(data):
+    global _CART_DB
+    _CART_DB = data
+    # serialise now so later in-memory edits can't race the background write
+    _CART_WRITER.submit(_write_cart_file, json.dumps(data, indent=2))
+
+def _normalize_cart(cart):
+    """Coerce price/qty once at load so renderers can format directly."""
+    for item in cart.values():
+        item["price"] = float(item.get("price", 0) or 0)
+        item["qty"] = int(item.get("qty", 0) or 0)
+    return cart
 
 def get_user_cart(uid):
-    return load_cart().get(str(uid), {})
+    # per-row copies: callers edit this and then save_user_cart()
+    cart = {sku: dict(item) for sku, item in load_cart().get(str(uid), {}).items()}
+    return _normalize_cart(cart)
+
+def cart_item_count(uid) -> int:
+    """Total qty for the menu badge; reads the in-memory cart without copying it."""
+    return sum(int(item.get("qty", 0) or 0) for item in load_cart().get(str(uid), {}).values())
+
+def cart_qty(uid, sku) -> int:
+    """Qty of one sku in uid's cart (0 if absent); no copy, read-only."""
+    return int(load_cart().get(str(uid), {}).get(sku, {}).get("qty", 0) or 0)
 
 def save_user_cart(uid, cart):
     db = load_cart()
@@ -157,6 +207,7 @@ def _is_mini_panel(text):
 
 
 async def show_add_to_cart_feedback(update, context, sku, source="shop"):
+    from modules import ui                    # lazy: ui imports shopping_cart
     q = update.callback_query
     uid = update.effective_user.id
     context.user_data["mini_source"] = source
@@ -164,16 +215,15 @@ async def show_add_to_cart_feedback(update, context, sku, source="shop"):
     cart = get_user_cart(uid)
     item = cart.get(sku)
     if not item:
-        from modules import ui
         txt, kb = ui.build_shop_keyboard(uid)
         return await q.edit_message_text(txt, reply_markup=kb, parse_mode="Markdown")
 
     qty = item["qty"]
-    price = float(item["price"])
+    price = item["price"]
     subtotal = price * qty
 
     text = (
-        f"✔️ *Added to cart!* {item['name']}\n"
+        f"✔️ *Added to cart!* {ui.md_escape(item['name'])}\n"
         f"Qty: *{qty}*\n"
         f"💵 Price: ${price:.2f} × {qty} = *${subtotal:.2f}*"
     )
@@ -205,7 +255,7 @@ async def show_add_to_cart_feedback(update, context, sku, source="shop"):
     # safe to edit
     try:
         return await q.edit_message_text(text, parse_mode="Markdown", reply_markup=kb)
-    except Exception as e:
+    except BadRequest as e:
         if "not modified" in str(e).lower():
             return await q.answer()
         raise
@@ -267,34 +317,26 @@ async def view_cart(update, context):
         return await q.edit_message_text(
             "🛒 *Your cart is empty.*",
             parse_mode="Markdown",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("🛍 Shop", callback_data="menu:shop")],
-                [InlineKeyboardButton("🏠 Menu", callback_data="menu:main")]
-            ])
+            reply_markup=_KB_EMPTY_CART
         )
 
-    rows   = []
-    total  = 0
+    # subtotals first, then one C-level reduction for the total
+    subtotals = [item["price"] * item["qty"] for item in cart.values()]
+    total     = math.fsum(subtotals)
 
     # build product rows
-    for sku, item in cart.items():
-        emoji      = item.get("emoji", "🛒")
-        name       = item["name"]
-        price      = float(item["price"])
-        qty        = item["qty"]
-        subtotal   = price * qty
-        total     += subtotal
-
-        btn_text = (
-            f"{emoji} *{name}*\n"
-            f"Qty: {qty} • ${price:.2f} each\n"
-            f"Subtotal: ${subtotal:.2f}"
-        )
-
-        rows.append([
-            InlineKeyboardButton(btn_text, callback_data=f"cart:edit:{sku}:cart"),
+    rows = [
+        [
+            InlineKeyboardButton(
+                f"{item.get('emoji', '🛒')} *{item['name']}*\n"
+                f"Qty: {item['qty']} • ${item['price']:.2f} each\n"
+                f"Subtotal: ${subtotal:.2f}",
+                callback_data=f"cart:edit:{sku}:cart"
+            ),
             InlineKeyboardButton("✖️", callback_data=f"cart:remove:{sku}")
-        ])
+        ]
+        for (sku, item), subtotal in zip(cart.items(), subtotals)
+    ]
 
     # total line
     header = f"🛒 *Your Cart*\n💰 *Total:* ${total:.2f}"
@@ -308,7 +350,7 @@ async def view_cart(update, context):
 
     # footer
     rows.append([InlineKeyboardButton("🧹 Clear All", callback_data="cart:clear_all")])
-    rows.append([InlineKeyboardButton("🏠 Menu", callback_data="menu:main")])
+    rows.append([BTN_HOME])
 
     return await q.edit_message_text(
         header,
@@ -336,8 +378,5 @@ async def clear_all(update, context):
     return await q.edit_message_text(
         "🧹 *Your cart has been cleared!*",
         parse_mode="Markdown",
-        reply_markup=InlineKeyboardMarkup([
-            [InlineKeyboardButton("🛍 Shop", callback_data="menu:shop")],
-            [InlineKeyboardButton("🏠 Menu", callback_data="menu:main")]
-        ])
+        reply_markup=_KB_EMPTY_CART
     )
\ No newline at end of file
@@ -1,10 +1,19 @@
 import os
 import json
 import time
+import uuid
+from dataclasses import dataclass
 from typing import List, Dict, Tuple, Set
 from typing import Optional, Tuple, Dict
 import datetime as _dt 
 
+# orjson parses in C, several times faster than stdlib json on our files.
+# optional: fall back to json if it isn't installed
+try:
+    import orjson as _orjson
+except ImportError:
+    _orjson = None
+
 # Initialize the global dictionary to store user carts
 CART_FILE = "data/cart.json"
 
@@ -72,18 +81,55 @@ def load_json(path: str):
             f.write("{}")
         return {}
 
-    with open(path, "r", encoding="utf-8") as f:
+    with open(path, "rb") as f:
+        raw = f.read()
+    if _orjson is not None:
         try:
-            return json.load(f)
+            return _orjson.loads(raw)
         except Exception:
-            return {}
+            pass        # e.g. NaN/Infinity from an older write: let json decide
+    try:
+        return json.loads(raw)
+    except Exception:
+        return {}
+
+def _file_key(path: str):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+# path -> ((mtime_ns, size), parsed data)
+_JSON_CACHE: Dict[str, tuple] = {}
+# path -> number of save_json calls; lets a parse done elsewhere tell
+# whether a write landed while it was reading
+_JSON_WRITES: Dict[str, int] = {}
+
+def load_json_cached(path: str):
+    """
+    load_json memoised on the file's (mtime_ns, size).
+    Returns a SHARED object: read-only callers only; writers use load_json.
+    """
+    key = _file_key(path)
+    hit = _JSON_CACHE.get(path)
+    if key is not None and hit is not None and hit[0] == key:
+        return hit[1]
+    data = load_json(path)
+    if key is not None:
+        _JSON_CACHE[path] = (key, data)
+    return data
 
 def save_json(path: str, data):
     _ensure_parent_dir(path)
     tmp = path + ".tmp"
     with open(tmp, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
-    os.replace(tmp, path)   
+        json.dump(data, f, indent=2, ensure_ascii=False, allow_nan=False)
+    os.replace(tmp, path)
+    # drop the memoised parse: a same-size rewrite inside one mtime tick
+    # would otherwise keep serving the old data
+    _JSON_WRITES[path] = _JSON_WRITES.get(path, 0) + 1
+    _JSON_CACHE.pop(path, None)
 
 # =========================================================
 # SEED BUILT-IN PRODUCTS INTO SELLER_PRODUCTS (ONCE)
@@ -119,7 +165,8 @@ def is_spamming(user_id: int, cooldown: float = 1.25) -> bool:
 # BALANCES
 # =========================================================
 def get_balance(user_id: int) -> float:
-    return float(load_json(BALANCES_FILE).get(str(user_id), 0.0))
+    # read-only → mtime cache; set_balance's save_json drops the entry
+    return float(load_json_cached(BALANCES_FILE).get(str(user_id), 0.0))
 
 def set_balance(user_id: int, value: float):
     data = load_json(BALANCES_FILE)
@@ -139,7 +186,8 @@ def get_cart(user_id):
 # =========================================================
 def add_order(buyer_id: int, item_name: str, qty: int, amount: float, method: str, seller_id: int) -> str:
     orders = load_json(ORDERS_FILE)
-    order_id = f"ord_{int(time.time())}"
+    # random suffix: two orders in the same second must not overwrite each other
+    order_id = f"ord_{uuid.uuid4().hex[:12]}"
     orders[order_id] = {
         "id": order_id,
         "item": item_name,
@@ -157,39 +205,69 @@ def add_order(buyer_id: int, item_name: str, qty: int, amount: float, method: st
 def get_order_by_id(order_id: str):
     return load_json(ORDERS_FILE).get(str(order_id))
 
-def update_order_status(order_id: str, new_status: str, reason: str = None) -> bool:
-    orders = load_json(ORDERS_FILE)
-    if order_id in orders:
-        orders[order_id]["status"] = new_status
-        if reason:
-            orders[order_id]["status_reason"] = reason
-        save_json(ORDERS_FILE, orders)
-        return True
-    return False
-
-def list_orders_for_user(user_id: int) -> List[Dict]:
+def update_order_status(order_id: str, new_status: str, reason: str = None, **fields) -> Optional[Dict]:
+    """
+    Set status (+ optional reason and extra fields) in one read/write.
+    Returns the updated order, so callers needn't re-read it; None if missing.
+    """
     orders = load_json(ORDERS_FILE)
-    out: List[Dict] = []
+    o = orders.get(order_id)
+    if o is None:
+        return None
+    o["status"] = new_status
+    if reason:
+        o["status_reason"] = reason
+    o.update(fields)
+    save_json(ORDERS_FILE, orders)
+    return o
+
+@dataclass(slots=True)
+class OrderRow:
+    """Read-only order view for list renderers (slot access, no dict lookups)."""
+    id: str
+    item: str
+    qty: int
+    amount: float
+    status: str
+    seller_id: int
+    buyer_id: int
+    ts: int
+
+    @classmethod
+    def from_dict(cls, oid: str, o: Dict) -> "OrderRow":
+        # coerce once here so the UI can format without float()/int() per row
+        return cls(
+            id=oid,
+            item=o.get("item", "Product"),
+            qty=int(o.get("qty", 1) or 1),
+            amount=float(o.get("amount", 0) or 0),
+            status=str(o.get("status", "pending")).lower(),
+            seller_id=int(o.get("seller_id", 0) or 0),
+            buyer_id=int(o.get("buyer_id", 0) or 0),
+            ts=int(o.get("ts", 0) or 0),
+        )
+
+def list_orders_for_user(user_id: int) -> List[OrderRow]:
+    orders = load_json_cached(ORDERS_FILE)      # read-only: rows are copied out
+    out: List[OrderRow] = []
     for oid, o in orders.items():
         if user_id in (o.get("buyer_id"), o.get("seller_id")):
             if not is_archived_for_user(o, user_id):
-                obj = dict(o)
-                obj["id"] = oid
-                out.append(obj)
-    return sorted(out, key=lambda x: x.get('ts', 0), reverse=True)
+                out.append(OrderRow.from_dict(oid, o))
+    out.sort(key=lambda r: r.ts, reverse=True)
+    return out
 
 # =========================================================
 # PRODUCT VISIBILITY
 # =========================================================
 def toggle_product_visibility(sku: str):
     data = load_json(SELLER_PRODUCTS_FILE)
-    for uid, items in data.items():
-        for item in items:
-            if item.get("sku") == sku:
-                item["hidden"] = not item.get("hidden", False)
-                save_json(SELLER_PRODUCTS_FILE, data)
-                return True
-    return False
+    item = find_product_mut(data, sku)
+    if item is None:
+        return False
+    item["hidden"] = not item.get("hidden", False)
+    save_json(SELLER_PRODUCTS_FILE, data)
+    return True
 
 
 # =========================================================
@@ -229,41 +307,81 @@ def add_seller_product(
 
     return sku
 
+# flat sku -> (seller_id, product) view of the nested file, rebuilt only
+# when the cached parse changes (any save_json bumps the file's mtime)
+# (one slot, swapped in a single assignment so data and index always match)
+_PRODUCTS_INDEX = {"snap": (None, {})}
+
+def load_products_index() -> Dict[str, Tuple[str, Dict]]:
+    """Shared {sku: (sid, product)}; first listing wins on duplicate skus. Read-only."""
+    data = load_json_cached(SELLER_PRODUCTS_FILE)
+    snap = _PRODUCTS_INDEX["snap"]
+    if snap[0] is not data:
+        index: Dict[str, Tuple[str, Dict]] = {}
+        for sid, items in data.items():
+            for it in items:
+                index.setdefault(str(it.get("sku")), (sid, it))
+        snap = _PRODUCTS_INDEX["snap"] = (data, index)
+    return snap[1]
+
 def get_seller_product_by_sku(sku: str) -> Optional[Tuple[str, Dict]]:
-    data = load_json(SELLER_PRODUCTS_FILE)
-    for sid, items in data.items():
+    return load_products_index().get(str(sku), (None, None))
+
+def find_product_mut(data: Dict, sku: str) -> Optional[Dict]:
+    """
+    Row for sku inside a fresh load_json() of the products file, for writers.
+    Scans only that data: the read cache was just dropped by the writer's
+    last save_json, so consulting it would re-parse the file.
+    """
+    sku = str(sku)
+    for items in data.values():
+        for it in items:
+            if str(it.get("sku")) == sku:
+                return it
+    return None
+
+def product_rows_mut(data: Dict) -> Dict[str, Dict]:
+    """{sku: row} over a fresh load_json(), for writers touching several skus; first listing wins."""
+    rows: Dict[str, Dict] = {}
+    for items in data.values():
         for it in items:
-            if str(it.get("sku")) == str(sku):
-                return sid, it
-    return None, None
+            rows.setdefault(str(it.get("sku")), it)
+    return rows
+
+def get_seller_products_by_skus(skus) -> Dict[str, Dict]:
+    """Bulk variant: one index lookup per sku → {sku: product} for the wanted skus."""
+    index = load_products_index()
+    found: Dict[str, Dict] = {}
+    for s in skus:
+        hit = index.get(str(s))
+        if hit is not None:
+            found[str(s)] = hit[1]
+    return found
 
 def update_seller_stock(sku: str, delta: int) -> bool:
     data = load_json(SELLER_PRODUCTS_FILE)
-    for sid, items in data.items():
-        for it in items:
-            if it.get("sku") == sku:
-                cur = int(it.get("stock", 0))
-                nxt = cur + int(delta)
-                if nxt < 0:
-                    return False
-                it["stock"] = nxt
-                save_json(SELLER_PRODUCTS_FILE, data)
-                return True
-    return False
+    it = find_product_mut(data, sku)
+    if it is None:
+        return False
+    nxt = int(it.get("stock", 0)) + int(delta)
+    if nxt < 0:
+        return False
+    it["stock"] = nxt
+    save_json(SELLER_PRODUCTS_FILE, data)
+    return True
 
 
 def set_seller_stock(sku: str, stock: int) -> bool:
     data = load_json(SELLER_PRODUCTS_FILE)
-    for sid, items in data.items():
-        for it in items:
-            if it.get("sku") == sku:
-                it["stock"] = max(0, int(stock))
-                save_json(SELLER_PRODUCTS_FILE, data)
-                return True
-    return False
+    it = find_product_mut(data, sku)
+    if it is None:
+        return False
+    it["stock"] = max(0, int(stock))
+    save_json(SELLER_PRODUCTS_FILE, data)
+    return True
 
 def list_seller_products(seller_id: int) -> List[Dict]:
-    data = load_json(SELLER_PRODUCTS_FILE)
+    data = load_json_cached(SELLER_PRODUCTS_FILE)
     items = data.get(str(seller_id), [])
     # return only active (not hidden) listings
     return [p for p in items if not p.get("hidden", False)]
@@ -385,6 +503,63 @@ def hide_chat_for_user(thread_id: str, user_id: int):
             return True
     return False
 
+# per-user thread index over the cached parse of MESSAGES_FILE; rebuilt only
+# when load_json_cached hands back a new object (mtime change or save_json)
+_THREADS_INDEX = {"snap": (None, {})}
+
+def threads_for_user(user_id: int) -> List[Tuple[str, str]]:
+    """
+    [(thread_id, product name)] visible to user_id, in file order.
+    Shared list rebuilt only when messages.json changes; read-only.
+    """
+    threads = load_json_cached(MESSAGES_FILE)
+    snap = _THREADS_INDEX["snap"]
+    if snap[0] is not threads:
+        by_user: Dict[int, List[Tuple[str, str]]] = {}
+        for tid, t in threads.items():
+            hidden = t.get("hidden_from", [])
+            row = (tid, (t.get("product") or {}).get("name", "Chat"))
+            for u in {t.get("buyer_id"), t.get("seller_id")}:
+                if u is not None and u not in hidden:
+                    by_user.setdefault(u, []).append(row)
+        snap = _THREADS_INDEX["snap"] = (threads, by_user)
+
+    return snap[1].get(user_id, [])
+
+_SNAPSHOT_FILES = (SELLER_PRODUCTS_FILE, MESSAGES_FILE)
+
+def read_snapshots() -> List[tuple]:
+    """
+    Parse the read-mostly files that changed since the cached copy.
+    Blocking I/O, safe to run off the event loop: only reads, touches no
+    cache. Hand the result to publish_snapshots on the loop.
+    """
+    out = []
+    for path in _SNAPSHOT_FILES:
+        writes = _JSON_WRITES.get(path, 0)
+        key = _file_key(path)
+        hit = _JSON_CACHE.get(path)
+        if key is None or (hit is not None and hit[0] == key):
+            continue
+        out.append((path, key, writes, load_json(path)))
+    return out
+
+def publish_snapshots(snaps: List[tuple]) -> None:
+    """
+    Install parses from read_snapshots and rebuild the indexes over them.
+    Call on the event loop. A parse is dropped if the file was saved or
+    changed on disk since it was read, so a stale copy never replaces a
+    newer one.
+    """
+    for path, key, writes, data in snaps:
+        if _JSON_WRITES.get(path, 0) != writes or _file_key(path) != key:
+            continue
+        hit = _JSON_CACHE.get(path)
+        if hit is None or hit[0] != key:
+            _JSON_CACHE[path] = (key, data)
+    load_products_index()
+    threads_for_user(0)
+
 def append_chat_message(thread_id: str, from_user: int, text: str):
     threads = load_json(MESSAGES_FILE)
     if thread_id in threads:
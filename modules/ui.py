@@ -1,25 +1,90 @@
+import asyncio
 import os
-import qrcode
+import sys
+import random
 import re
-from io import BytesIO
+import httpx
+from functools import lru_cache
+from itertools import islice
 from dotenv import load_dotenv
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputFile, LabeledPrice
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.constants import ParseMode
+from telegram.error import BadRequest
 from telegram.ext import ContextTypes
 from typing import Optional
 from modules import shopping_cart, storage, inventory, wallet_utils, seller
-import stripe
+from modules.buttons import CB_MENU_MAIN, BTN_HOME, KB_JUST_HOME
 import logging
 logger = logging.getLogger(__name__)
 
-from modules import storage, seller, chat, inventory, shopping_cart
-import modules.wallet_utils as wallet
-
 # Load .env
 load_dotenv()
-STRIPE_SECRET_KEY = os.getenv("STRIPE_SECRET_KEY", "").strip()
-stripe.api_key = STRIPE_SECRET_KEY
 ADMIN_ID = int(os.getenv("ADMIN_ID", "0"))
+SERVER_BASE_URL = os.getenv("SERVER_BASE_URL", "").rstrip("/")
+# payment-server endpoints, joined once
+STRIPE_SESSION_URL = f"{SERVER_BASE_URL}/create_checkout_session"
+HITPAY_CREATE_URL  = f"{SERVER_BASE_URL}/hitpay/create_payment"
+
+_MD = ParseMode.MARKDOWN               # one enum, used for every send/edit
+
+# storage helpers used across the checkout/dispute handlers, bound once
+_update_status = storage.update_order_status
+_load_json     = storage.load_json
+
+# one keep-alive client for calls to our payment server; awaited, so a
+# slow payment call never blocks the loop. created lazily: httpx wants to
+# be opened inside the running event loop
+HTTP_TIMEOUT_S = 15
+_HTTP: Optional[httpx.AsyncClient] = None
+
+def _http() -> httpx.AsyncClient:
+    global _HTTP
+    if _HTTP is None:
+        _HTTP = httpx.AsyncClient(timeout=HTTP_TIMEOUT_S)
+    return _HTTP
+
+async def close_http():
+    """Close the shared client on shutdown (pooled sockets otherwise leak)."""
+    global _HTTP
+    if _HTTP is not None:
+        await _HTTP.aclose()
+        _HTTP = None
+
+# legacy Markdown: escape user text that sits outside an entity.
+# one translate table built at import, no regex per render
+_MD_ESCAPE = str.maketrans({c: f"\\{c}" for c in "_*`["})
+
+def md_escape(text) -> str:
+    return str(text).translate(_MD_ESCAPE)
+
+# ===========================
+# CALLBACK IDS (static, interned once)
+# ===========================
+CB_MENU_SHOP      = sys.intern("menu:shop")
+CB_MENU_ORDERS    = sys.intern("menu:orders")
+CB_MENU_FUNCTIONS = sys.intern("menu:functions")
+CB_CART_VIEW      = sys.intern("cart:view")
+CB_SHOP_SEARCH    = sys.intern("shop:search")
+CB_NOOP           = sys.intern("noop")
+
+# shared empty-state keyboards (markups are immutable → safe to reuse)
+_KB_NO_ORDERS  = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🔄 Refresh", callback_data=CB_MENU_ORDERS), BTN_HOME]
+])
+
+# static back/cancel buttons spliced into per-item keyboards
+BTN_BACK_MARKET  = InlineKeyboardButton("🔙 Back to Marketplace", callback_data=CB_MENU_SHOP)
+BTN_BACK_SHOP    = InlineKeyboardButton("🔙 Back to Shop", callback_data=CB_MENU_SHOP)
+BTN_CANCEL_SHOP  = InlineKeyboardButton("❌ Cancel", callback_data=CB_MENU_SHOP)
+BTN_CANCEL_CART  = InlineKeyboardButton("❌ Cancel", callback_data=CB_CART_VIEW)
+_BTN_SEARCH_AGAIN = InlineKeyboardButton("🔍 Search Again", callback_data=CB_SHOP_SEARCH)
+
+# deep-link return screens (paid / still processing)
+_KB_PAID = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📦 View Order Status", callback_data=CB_MENU_ORDERS)],
+    [InlineKeyboardButton("🏠 Main Menu", callback_data=CB_MENU_MAIN)]
+])
+_KB_REFRESH_ORDERS = InlineKeyboardMarkup([[InlineKeyboardButton("🔄 Refresh Orders", callback_data=CB_MENU_ORDERS)]])
 
 # ===========================
 # BUILT-IN PRODUCTS (Static)
@@ -57,49 +122,147 @@ CATALOG = {
 # ==========================================
 # PRODUCT LOADING
 # ==========================================
+def _normalize_product(it):
+    """Fill optional fields once at load so renderers index directly."""
+    it["name"] = it.get("name") or it.get("title") or "Unnamed"
+    it["price"] = float(it.get("price", 0) or 0)
+    it["stock"] = int(it.get("stock", 0) or 0)
+    it["seller_id"] = int(it.get("seller_id", 0) or 0)
+    it["desc"] = it.get("desc") or ""
+    it.setdefault("emoji", "📦")
+    it.setdefault("image_url", None)
+    it.setdefault("hidden", False)
+    return it
+
+# built-ins fully materialised once at import; never rebuilt with the cache
+_BUILTIN_ITEMS = tuple(_normalize_product({**p, "sku": sku}) for sku, p in CATALOG.items())
+_BUILTIN_BY_SKU = {it["sku"]: it for it in _BUILTIN_ITEMS}
+
+# merged product list, rebuilt only when storage hands back a new parse of the
+# seller file (mtime change or a save_json through storage). "key" is a
+# generation number that downstream caches (shop pages) compare against.
+_PRODUCTS_CACHE = {"key": 0, "data": None, "items": None, "visible": (), "shop": (),
+                   "by_sku": {}, "search": (), "trigrams": {}}
+
 def enumerate_all_products():
+    """Shared, read-only list of every product. Callers must not mutate it."""
+    data = storage.load_json_cached(storage.SELLER_PRODUCTS_FILE)
+    if _PRODUCTS_CACHE["items"] is not None and _PRODUCTS_CACHE["data"] is data:
+        return _PRODUCTS_CACHE["items"]
+
     items = []
     seen_skus = set()
 
     # 1. Load dynamic seller products first
-    data = storage.load_json(storage.SELLER_PRODUCTS_FILE)
     for _, plist in data.items():
         for it in plist:
             sku = it.get("sku")
             if sku not in seen_skus:
-                items.append(it)
+                items.append(_normalize_product(dict(it)))   # cached data is shared
                 seen_skus.add(sku)
 
     # 2. Add static items ONLY if the SKU hasn't been seen yet
-    for sku, p in CATALOG.items():
-        if sku not in seen_skus:
-            items.append({**p, "sku": sku})
-            seen_skus.add(sku)
-
+    items.extend(it for it in _BUILTIN_ITEMS if it["sku"] not in seen_skus)
+
+    # sku → item; direct lookups give CATALOG precedence over seller copies
+    by_sku = {it.get("sku"): it for it in items}
+    by_sku.update(_BUILTIN_BY_SKU)
+
+    # visible items (shop pages) and search rows: (item, normalised name, haystack)
+    visible = [it for it in items if not it["hidden"]]
+    search = []
+    for it in visible:
+        name = _norm_text(it["name"])
+        search.append((it, name, f"{name} {_norm_text(it['sku'])}"))
+
+    # trigram → row indices into `search`, so a query only verifies candidates
+    trigrams = {}
+    for idx, (_, _, hay) in enumerate(search):
+        for i in range(len(hay) - 2):
+            trigrams.setdefault(hay[i:i + 3], set()).add(idx)
+
+    _PRODUCTS_CACHE["key"] += 1
+    _PRODUCTS_CACHE["data"] = data
+    _PRODUCTS_CACHE["items"] = items
+    _PRODUCTS_CACHE["visible"] = visible
+    _PRODUCTS_CACHE["shop"] = [_shop_entry(it) for it in visible]
+    _PRODUCTS_CACHE["by_sku"] = by_sku
+    _PRODUCTS_CACHE["search"] = search
+    _PRODUCTS_CACHE["trigrams"] = trigrams
     return items
 
 
 def get_any_product_by_sku(sku: str):
-    if sku in CATALOG:
-        return CATALOG[sku]
-    data = storage.load_json(storage.SELLER_PRODUCTS_FILE)
-    for _, items in data.items():
-        for it in items:
-            if it.get("sku") == sku:
-                return it
-    return None
+    enumerate_all_products()            # refresh the index if the data changed
+    return _PRODUCTS_CACHE["by_sku"].get(sku)
 
 
+# ==========================================
+# DEBOUNCED EDITS (rapid page taps)
+# ==========================================
+EDIT_DEBOUNCE_S = 0.15
+_PENDING_EDITS = {}          # (user_id, message_id) -> asyncio.Task
+_PENDING_QTY = {}            # (user_id, message_id) -> qty of the queued, undrawn card
+
+def debounce_edit(key, render, delay: float = EDIT_DEBOUNCE_S):
+    """
+    Schedule `render()` (an async fn) after `delay` seconds.
+    A newer call with the same key cancels the pending one, so a burst of
+    Prev/Next taps only builds + edits the last page.
+    """
+    prev = _PENDING_EDITS.get(key)
+    if prev is not None and not prev.done():
+        prev.cancel()
+
+    async def _run():
+        await asyncio.sleep(delay)
+        # past the wait → no longer cancellable by newer taps
+        if _PENDING_EDITS.get(key) is task:
+            del _PENDING_EDITS[key]
+            _PENDING_QTY.pop(key, None)
+        try:
+            await render()
+        except BadRequest as e:
+            # re-render of an identical card is fine; anything else is a real failure
+            if "not modified" not in str(e).lower():
+                logger.exception("debounced edit failed for %s", key)
+        except Exception:
+            logger.exception("debounced edit failed for %s", key)
+
+    task = asyncio.create_task(_run())
+    _PENDING_EDITS[key] = task
+    return task
+
+def cancel_pending_edit(key):
+    """Drop a debounced edit that hasn't fired yet (another button on that message won)."""
+    _PENDING_QTY.pop(key, None)
+    task = _PENDING_EDITS.pop(key, None)
+    if task is not None and not task.done():
+        task.cancel()
+
+def step_pending_qty(key, shown: int, step: int) -> int:
+    """
+    Qty a −/+ tap asks for. The card isn't redrawn until the burst ends, so
+    every tap in it carries the same `shown` qty; step from the queued qty
+    instead, or taps get lost.
+    """
+    base = _PENDING_QTY.get(key, shown) if key in _PENDING_EDITS else shown
+    qty = _PENDING_QTY[key] = clamp_qty(base + step)
+    return qty
 
 
 # ==========================================
 # SEARCH
 # ==========================================
+# compiled once; _norm_text runs for every query and every cache rebuild
+_NON_ALNUM_RE = re.compile(r"[^a-z0-9\s]+")
+_SPACES_RE    = re.compile(r"\s+")
+
 def _norm_text(s: str) -> str:
     s = str(s or "").lower()
     # keep letters/numbers/spaces only
-    s = re.sub(r"[^a-z0-9\s]+", " ", s)
-    s = re.sub(r"\s+", " ", s).strip()
+    s = _NON_ALNUM_RE.sub(" ", s)
+    s = _SPACES_RE.sub(" ", s).strip()
     return s
 
 def search_products_by_name(query: str, include_sold_out: bool = True):
@@ -111,30 +274,33 @@ def search_products_by_name(query: str, include_sold_out: bool = True):
     if not tokens:
         return []
 
-    results = []
-    for it in enumerate_all_products():
-        if it.get("hidden", False):
-            continue
-
-        name_raw = it.get("name") or it.get("title") or ""
-        sku_raw = it.get("sku") or ""
-
-        hay = f"{_norm_text(name_raw)} {_norm_text(sku_raw)}"
-
-        # require ALL tokens to appear somewhere
-        if all(t in hay for t in tokens):
-            stock = int(it.get("stock", 0) or 0)
-            if include_sold_out or stock > 0:
-                results.append(it)
+    enumerate_all_products()            # refresh the prebuilt haystacks if needed
+    search = _PRODUCTS_CACHE["search"]
+    trigrams = _PRODUCTS_CACHE["trigrams"]
+
+    # narrow to rows holding every trigram of every 3+ char token;
+    # 1-2 char tokens can't be indexed and are only checked below
+    cand = None
+    for t in tokens:
+        for i in range(len(t) - 2):
+            ids = trigrams.get(t[i:i + 3])
+            if not ids:
+                return []
+            cand = set(ids) if cand is None else cand & ids
+            if not cand:
+                return []
+    rows = search if cand is None else [search[i] for i in sorted(cand)]
+
+    # require ALL tokens to appear somewhere; haystacks are normalised at rebuild
+    hits = [
+        (name, it) for it, name, hay in rows
+        if all(t in hay for t in tokens) and (include_sold_out or it["stock"] > 0)
+    ]
 
     # sort by relevance: startswith first, then shorter name
-    def score(it):
-        name = _norm_text(it.get("name") or it.get("title") or "")
-        starts = 0 if name.startswith(tokens[0]) else 1
-        return (starts, len(name))
-
-    results.sort(key=score)
-    return results
+    first = tokens[0]
+    hits.sort(key=lambda h: (0 if h[0].startswith(first) else 1, len(h[0])))
+    return [it for _, it in hits]
 
 async def ask_user_search(update, context):
     q = update.callback_query
@@ -142,7 +308,7 @@ async def ask_user_search(update, context):
 
     await q.edit_message_text(
         "👤 *Search Users*\n\nSend a *username* or *user ID*.",
-        parse_mode="Markdown",
+        parse_mode=_MD,
     )
 
 async def ask_search(update, context):
@@ -151,7 +317,7 @@ async def ask_search(update, context):
 
     await q.edit_message_text(
         "🔍 *Search Products*\n\nSend a product name.",
-        parse_mode="Markdown",
+        parse_mode=_MD,
     )
 
 async def show_user_search_results(update, context, results):
@@ -168,17 +334,18 @@ async def show_user_search_results(update, context, results):
         uname = u.get("username") or "Anonymous"
         
         # Fetch items this specific user is selling
-        user_items = [it for it in enumerate_all_products() if str(it.get("seller_id")) == str(uid)]
+        user_items = [it for it in enumerate_all_products() if str(it["seller_id"]) == str(uid)]
         
-        item_list = ""
         if user_items:
-            item_list = "\n".join([f"  ├ {it['emoji']} {it['name']} (${it['price']})" for it in user_items[:3]])
-            if len(user_items) > 3: item_list += "\n  └ ... and more"
+            lines = [f"  ├ {it['emoji']} {md_escape(it['name'])} (${it['price']})" for it in user_items[:3]]
+            if len(user_items) > 3:
+                lines.append("  └ ... and more")
+            item_list = "\n".join(lines)
         else:
             item_list = "  └ _No active listings_"
 
         blocks.append(
-            f"👤 **{uname}** (`{uid}`)\n"
+            f"👤 **{md_escape(uname)}** (`{uid}`)\n"
             f"{item_list}"
         )
 
@@ -186,12 +353,13 @@ async def show_user_search_results(update, context, results):
             InlineKeyboardButton(f"💬 Message {uname}", callback_data=f"chat:user:{uid}")
         ])
 
-    buttons.append([InlineKeyboardButton("🏠 Home", callback_data="menu:main")])
+    buttons.append([BTN_HOME])
 
+    body = "\n\n".join(blocks)
     await msg.reply_text(
-        "🔍 **User Search Results**\n" + "━" * 15 + "\n\n" + "\n\n".join(blocks),
+        f"🔍 **User Search Results**\n{'━' * 15}\n\n{body}",
         reply_markup=InlineKeyboardMarkup(buttons),
-        parse_mode="Markdown"
+        parse_mode=_MD
     )
 
 async def show_search_results(update, context, results):
@@ -208,17 +376,17 @@ async def show_search_results(update, context, results):
         if not sku:
             continue
 
-        name = it.get("name") or it.get("title") or "Unnamed"
-        emoji = it.get("emoji", "📦")
-        price = float(it.get("price", 0))
-        stock = int(it.get("stock", 0))
-        sid = it.get("seller_id", 0)
+        name = it["name"]
+        emoji = it["emoji"]
+        pstr = f"{it['price']:.2f}"          # formatted once, reused below
+        stock = it["stock"]
+        sid = it["seller_id"]
 
         seller_label = "System" if sid == 0 else f"User {sid}"
         stock_text = f"{stock} left" if stock > 0 else "SOLD OUT"
 
         blocks.append(
-            f"{emoji} {name} — ${price:.2f}\n"
+            f"{emoji} {name} — ${pstr}\n"
             f"Seller: {seller_label}\n"
             f"Stock: {stock_text}"
         )
@@ -226,36 +394,64 @@ async def show_search_results(update, context, results):
         view_btn = InlineKeyboardButton(f"🔎 View {str(name)[:12]}", callback_data=f"view_item:{sku}")
 
         if stock > 0:
-            cart_btn = InlineKeyboardButton(f"🛒 +Cart (${price:.2f})", callback_data=f"cart:add:{sku}")
+            cart_btn = InlineKeyboardButton(f"🛒 +Cart (${pstr})", callback_data=f"cart:add:{sku}")
             rows.append([view_btn, cart_btn])
         else:
             # no add-to-cart button when sold out
             rows.append([view_btn])
 
 
-    rows.append([InlineKeyboardButton("🔍 Search Again", callback_data="shop:search")])
-    rows.append([InlineKeyboardButton("🏠 Home", callback_data="menu:main")])
+    rows.append([_BTN_SEARCH_AGAIN])
+    rows.append([BTN_HOME])
 
+    body = "\n\n".join(blocks)
     return await msg.reply_text(
-        "🔍 Search Results\n\n" + "\n\n".join(blocks),
+        f"🔍 Search Results\n\n{body}",
         reply_markup=InlineKeyboardMarkup(rows),
     )
 
 # ==========================================
 # MAIN MENU
 # ==========================================
+# static menu pieces, built once at import; only the cart label changes
+_MAIN_ROW_TOP = (
+    InlineKeyboardButton("🛍 Marketplace", callback_data=CB_MENU_SHOP),
+    InlineKeyboardButton("📦 Orders", callback_data=CB_MENU_ORDERS),
+)
+_BTN_WALLET = InlineKeyboardButton("💼 Wallet", callback_data="menu:wallet")
+_MAIN_ROWS_TAIL = (
+    (InlineKeyboardButton("🛠 Sell", callback_data="menu:sell"),
+     InlineKeyboardButton("✉ Messages", callback_data="menu:messages")),
+    (InlineKeyboardButton("💬 Lounge", callback_data="chat:public_open"),
+     InlineKeyboardButton("⚙ Functions", callback_data=CB_MENU_FUNCTIONS)),
+    (InlineKeyboardButton("🔄 Refresh", callback_data="menu:refresh"),),
+)
+
+_WALLET_KB = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📥 Deposit / View Address", callback_data="wallet:deposit")],
+    [InlineKeyboardButton("📤 Withdraw SOL",          callback_data="wallet:withdraw")],
+    [InlineKeyboardButton("🔧 Network Info",         callback_data="wallet:network")],
+    [BTN_HOME]
+])
+
+@lru_cache(maxsize=64)
+def _main_menu_kb(cart_count: int) -> InlineKeyboardMarkup:
+    """Whole main keyboard per cart count; markups are immutable, so share them."""
+    return InlineKeyboardMarkup([
+        _MAIN_ROW_TOP,
+        (InlineKeyboardButton(f"🛒 Cart ({cart_count})", callback_data=CB_CART_VIEW), _BTN_WALLET),
+        *_MAIN_ROWS_TAIL,
+    ])
+
 def build_main_menu(balance: float, uid: int = None):
     # ---- cart count ----
     cart_count = 0
     if uid is not None:
         try:
-            cart = shopping_cart.get_user_cart(uid)
-            cart_count = sum(item.get("qty", 0) for item in cart.values())
+            cart_count = shopping_cart.cart_item_count(uid)    # no per-row copies
         except Exception:
             cart_count = 0
 
-    cart_label = f"🛒 Cart ({cart_count})"
-
     # ---- crypto balances ----
     if uid is not None:
         wallet_dict = wallet_utils.ensure_user_wallet(uid)
@@ -265,31 +461,22 @@ def build_main_menu(balance: float, uid: int = None):
     else:
         bal_main = bal_dev = 0.0
 
-    kb = InlineKeyboardMarkup([
-        [InlineKeyboardButton("🛍 Marketplace", callback_data="menu:shop"),
-         InlineKeyboardButton("📦 Orders", callback_data="menu:orders")],
-        [InlineKeyboardButton(cart_label, callback_data="cart:view"),
-         InlineKeyboardButton("💼 Wallet", callback_data="menu:wallet")],
-        [InlineKeyboardButton("🛠 Sell", callback_data="menu:sell"),
-         InlineKeyboardButton("✉ Messages", callback_data="menu:messages")],
-        [InlineKeyboardButton("💬 Lounge", callback_data="chat:public_open"),
-         InlineKeyboardButton("⚙ Functions", callback_data="menu:functions")],
-        [InlineKeyboardButton("🔄 Refresh", callback_data="menu:refresh")],
-    ])
+    kb = _main_menu_kb(cart_count)
 
     # main text: crypto first, append stored $ only if > 0
-    text = (
+    parts = [
         "🌀 *Grand Stand Marketplace*\n"
-        "══════════════════════\n"
-        f"🌍 *Mainnet:* `{bal_main:.4f} SOL`\n"
-        f"🧪 *Devnet:* `{bal_dev:.4f} SOL`\n"
-    )
+        "══════════════════════\n",
+        f"🌍 *Mainnet:* `{bal_main:.4f} SOL`\n",
+        f"🧪 *Devnet:* `{bal_dev:.4f} SOL`\n",
+    ]
     if balance > 0:                       # legacy stored-dollar balance
-        text += f"💳 *Stored:* `${balance:.2f}`\n"
-    text += (
+        parts.append(f"💳 *Stored:* `${balance:.2f}`\n")
+    parts.append(
         "══════════════════════\n"
         "_Buy • Sell • Escrow • Trade Safely_"
     )
+    text = "".join(parts)
 
     return kb, text
 
@@ -297,97 +484,149 @@ def build_main_menu(balance: float, uid: int = None):
 # ==========================================
 # SHOP PAGE (UPDATED WITH NEW ADD TO CART)
 # ==========================================
+def _pager(base: str, page: int, has_next: bool):
+    """⬅️ / Page N / ➡️ row; callbacks are `<base><page>`."""
+    nav = [InlineKeyboardButton(f"Page {page+1}", callback_data=CB_NOOP)]
+    if page > 0:
+        nav.insert(0, InlineKeyboardButton("⬅️", callback_data=f"{base}{page-1}"))
+    if has_next:
+        nav.append(InlineKeyboardButton("➡️", callback_data=f"{base}{page+1}"))
+    return nav
 
-def build_shop_keyboard(uid=None, page=0):
-    all_items = [it for it in enumerate_all_products() if not it.get("hidden", False)]
-    items_per_page = 5
-    start_idx = page * items_per_page
-    current_items = all_items[start_idx : start_idx + items_per_page]
-
-    rows = []
-    display_lines = []
+# rendered pages for the current catalog version:
+#   page -> {"sellers": {seller ids on page}, "views": {owner_id|None: (text, kb)}}
+# only viewers who own an item on the page get their own view; everyone else shares one
+_SHOP_RENDER = {"key": None, "pages": {}}
 
+def build_shop_keyboard(uid=None, page=0):
     # fallback if uid missing
     viewer_id = int(uid) if uid else 0
 
-    for it in current_items:
-        sku = it["sku"]
-        price = it["price"]
-        stock = it.get("stock", 0)
-        sid = it.get("seller_id", 0)
-
-        seller_label = "System" if sid == 0 else f"User {sid}"
-        stock_text = f"{stock} left" if stock > 0 else "🛑 *SOLD OUT*"
-
-        display_lines.append(
-            f"{it.get('emoji','📦')} **{it['name']}** — `${price:.2f}`\n"
-            f"├ 👤 Seller: `{seller_label}`\n"
-            f"└ 📦 Stock: {stock_text}"
-        )
+    enumerate_all_products()                    # refresh the catalog if the data changed
+    key = _PRODUCTS_CACHE["key"]
+    if _SHOP_RENDER["key"] != key:
+        _SHOP_RENDER["key"] = key
+        _SHOP_RENDER["pages"] = {}
+
+    entry = _SHOP_RENDER["pages"].get(page)
+    if entry is not None:
+        owner = viewer_id if viewer_id in entry["sellers"] else None
+        hit = entry["views"].get(owner)
+        if hit is not None:
+            return hit
+
+    text, kb, sellers = _render_shop_page(viewer_id, page)
+    if entry is None:
+        entry = _SHOP_RENDER["pages"][page] = {"sellers": sellers, "views": {}}
+    owner = viewer_id if viewer_id in sellers else None
+    view = entry["views"][owner] = (text, kb)
+    return view
+
+# footer rows are the same on every page
+_SHOP_FOOTER = (
+    [InlineKeyboardButton("🔍 Search", callback_data=CB_SHOP_SEARCH),
+     InlineKeyboardButton("👤 Users", callback_data="search:users")],
+    [InlineKeyboardButton("🛒 Cart", callback_data=CB_CART_VIEW),
+     BTN_HOME],
+)
+SHOP_PAGE_SIZE = 5
+MESSAGES_PAGE_SIZE = 10
+
+def _shop_entry(it):
+    """(text block, view button, +cart button, seller id) for one item; built once per catalog load."""
+    sku, name, emoji = it["sku"], it["name"], it["emoji"]
+    stock, sid = it["stock"], it["seller_id"]
+    pstr = f"{it['price']:.2f}"
+
+    seller_label = "System" if sid == 0 else f"User {sid}"
+    stock_text = f"{stock} left" if stock > 0 else "🛑 *SOLD OUT*"
+
+    line = (
+        f"{emoji} **{md_escape(name)}** — `${pstr}`\n"
+        f"├ 👤 Seller: `{seller_label}`\n"
+        f"└ 📦 Stock: {stock_text}"
+    )
+    view_btn = InlineKeyboardButton(f"🔎 View {name[:12]}", callback_data=f"view_item:{sku}")
+    cart_btn = InlineKeyboardButton(f"🛒 +Cart (${pstr})", callback_data=f"cart:add:{sku}:shop")
+    return line, view_btn, cart_btn, sid
 
-        view_btn = InlineKeyboardButton(f"🔎 View {it['name'][:12]}", callback_data=f"view_item:{sku}")
+def _render_shop_page(viewer_id: int, page: int):
+    entries = _PRODUCTS_CACHE["shop"]
+    start_idx = page * SHOP_PAGE_SIZE
+    current = entries[start_idx : start_idx + SHOP_PAGE_SIZE]
 
-        # OWNER CAN’T BUY OWN ITEM
-        if viewer_id == sid:
-            rows.append([view_btn])                      # only “View”
-        else:
-            cart_btn = InlineKeyboardButton(f"🛒 +Cart (${price:.2f})", callback_data=f"cart:add:{sku}:shop")
-            rows.append([view_btn, cart_btn])            # normal two buttons
+    # OWNER CAN’T BUY OWN ITEM → only “View”; everyone else gets View + Cart
+    rows = [[view_btn] if viewer_id == sid else [view_btn, cart_btn]
+            for _, view_btn, cart_btn, sid in current]
 
     # Navigation & Footer
-    nav = [InlineKeyboardButton(f"Page {page+1}", callback_data="noop")]
-    if page > 0:
-        nav.insert(0, InlineKeyboardButton("⬅️", callback_data=f"shop_page:{page-1}"))
-    if start_idx + items_per_page < len(all_items):
-        nav.append(InlineKeyboardButton("➡️", callback_data=f"shop_page:{page+1}"))
-    rows.append(nav)
-
-    rows.append([
-        InlineKeyboardButton("🔍 Search", callback_data="shop:search"),
-        InlineKeyboardButton("👤 Users", callback_data="search:users")
-    ])
-    rows.append([
-        InlineKeyboardButton("🛒 Cart", callback_data="cart:view"),
-        InlineKeyboardButton("🏠 Home", callback_data="menu:main")
-    ])
+    rows.append(_pager("shop_page:", page, start_idx + SHOP_PAGE_SIZE < len(entries)))
+    rows.extend(_SHOP_FOOTER)
 
-    header = "🛍 **XCHANGE MARKETPLACE**\n" + "━" * 18 + "\n"
-    return header + "\n\n".join(display_lines), InlineKeyboardMarkup(rows)
+    body = "\n\n".join(line for line, _, _, _ in current)
+    sellers = {sid for _, _, _, sid in current}
+    return f"🛍 **XCHANGE MARKETPLACE**\n{'━' * 18}\n{body}", InlineKeyboardMarkup(rows), sellers
+
+# ==========================================
+# EDIT HELPER (text vs photo card)
+# ==========================================
+def _same_render(context, q, text, kb) -> bool:
+    """
+    True when this exact screen is already on the message: same markup on
+    q.message and the same text we last rendered into it. Lets re-taps skip
+    the edit round-trip (and Telegram's "message is not modified" 400).
+    """
+    if context is None:
+        return False
+    last = context.user_data.get("last_render")
+    return last == (q.message.message_id, hash(text)) and q.message.reply_markup == kb
+
+def _remember_render(context, q, text):
+    if context is not None:
+        context.user_data["last_render"] = (q.message.message_id, hash(text))
+
+async def edit_card(q, text, kb, parse_mode=_MD, context=None):
+    """Edit in place. Item photo cards hold a caption, not text → dispatch on type."""
+    if _same_render(context, q, text, kb):
+        return None
+    if q.message.photo:
+        res = await q.edit_message_caption(caption=text, reply_markup=kb, parse_mode=parse_mode)
+    else:
+        res = await q.edit_message_text(text, reply_markup=kb, parse_mode=parse_mode)
+    _remember_render(context, q, text)
+    return res
 
 # ==========================================
 # View Item Details Screen (Updated with Add-to-Cart qty)
 # ==========================================
 async def view_item_details(update, context, sku):
-    from modules import shopping_cart
-
     q = update.callback_query
     item = get_any_product_by_sku(sku)
     if not item:
         return await q.answer("Item not found.", show_alert=True)
 
     uid = update.effective_user.id
-    seller_id = int(item.get("seller_id", 0))
+    seller_id = item["seller_id"]
 
-    user_cart = shopping_cart.get_user_cart(uid)
-    current_qty = user_cart.get(sku, {}).get("qty", 0)
+    current_qty = shopping_cart.cart_qty(uid, sku)
     add_label = "🛒 Add to Cart" if current_qty == 0 else f"🛒 Add to Cart ({current_qty})"
 
     seller_label = "System Admin" if seller_id == 0 else f"User {seller_id}"
 
     text = (
-        f"{item.get('emoji','📦')} **{item['name']}**\n"
+        f"{item['emoji']} **{md_escape(item['name'])}**\n"
         f"━━━━━━━━━━━━━━━\n"
         f"👤 **Seller:** `{seller_label}`\n"
         f"💰 **Price:** `${item['price']:.2f}`\n"
-        f"📋 **In Stock:** `{item.get('stock', 0)}` units\n\n"
-        f"📝 **Description:**\n_{item.get('desc', 'No description provided.')}_"
+        f"📋 **In Stock:** `{item['stock']}` units\n\n"
+        f"📝 **Description:**\n_{item['desc'] or 'No description provided.'}_"
     )
 
     # GUARD: seller can’t buy own item
     if uid == seller_id:
         kb = InlineKeyboardMarkup([
             [InlineKeyboardButton("📊 Analytics", callback_data=f"analytics:single:{sku}")],
-            [InlineKeyboardButton("🔙 Back to Marketplace", callback_data="menu:shop")]
+            [BTN_BACK_MARKET]
         ])
     else:
         kb = InlineKeyboardMarkup([
@@ -395,27 +634,25 @@ async def view_item_details(update, context, sku):
                 InlineKeyboardButton(add_label, callback_data=f"cart:add:{sku}:view"),
                 InlineKeyboardButton("💰 Buy Now", callback_data=f"buy:{sku}:1")
             ],
-            [InlineKeyboardButton("🔙 Back to Marketplace", callback_data="menu:shop")]
+            [BTN_BACK_MARKET]
         ])
 
-    if item.get("image_url"):
+    if item["image_url"]:
         await q.message.delete()
         return await context.bot.send_photo(
             chat_id=update.effective_chat.id,
             photo=item["image_url"],
             caption=text,
-            parse_mode="Markdown",
+            parse_mode=_MD,
             reply_markup=kb
         )
 
-    await q.edit_message_text(text, reply_markup=kb, parse_mode="Markdown")
+    await edit_card(q, text, kb)
 
 # ==========================================
 # STRIPE — CART CHECKOUT
 # ==========================================
 async def stripe_cart_checkout(update, context, total_str):
-    import requests
-    
     q = update.callback_query
     uid = update.effective_user.id
     
@@ -446,47 +683,36 @@ async def stripe_cart_checkout(update, context, total_str):
         seller_id=0
     )
 
-    # Reserve each item
-    reserved = []
-    try:
-        for it in items_for_server:
-            sku = it["sku"]
-            qty = it["qty"]
-            ok, msg = inventory.reserve_for_payment(order_id, sku, qty)
-            if not ok:
-                raise RuntimeError(f"{sku}: {msg}")
-            reserved.append(sku)
-    except Exception as e:
-        # Rollback
-        for sku in reserved:
-            inventory.release_on_failure_or_refund(order_id, reason="cart_reserve_failed")
-        storage.update_order_status(order_id, "failed", reason=str(e))
-        return await q.answer(f"❌ {e}", show_alert=True)
+    # Reserve the whole cart in one go: one lock + one load/save for all
+    # items, and nothing is held if any line is short
+    ok, msg = inventory.reserve_cart_for_payment(order_id, items_for_server)
+    if not ok:
+        _update_status(order_id, "failed", reason=msg)
+        return await q.answer(f"❌ {msg}", show_alert=True)
 
     # Call server
     try:
-        SERVER_BASE = os.getenv("SERVER_BASE_URL", "").rstrip("/")
-        res = requests.post(
-            f"{SERVER_BASE}/create_checkout_session",
+        res = await _http().post(
+            STRIPE_SESSION_URL,
             json={
                 "order_id": order_id,
                 "user_id": uid,
                 "amount": total,
             },
-            timeout=15,
         )
         res.raise_for_status()
         checkout_url = res.json().get("checkout_url")
+        if not checkout_url:
+            raise ValueError("Server did not return checkout_url")
 
     except Exception as e:
-        for sku in reserved:
-            inventory.release_on_failure_or_refund(order_id, reason="stripe_call_failed")
-        storage.update_order_status(order_id, "failed", reason=str(e))
+        inventory.release_cart_on_failure_or_refund(order_id, reason="stripe_call_failed")
+        _update_status(order_id, "failed", reason=str(e))
         return await q.edit_message_text(f"❌ Stripe error: {e}")
 
     kb = InlineKeyboardMarkup([
         [InlineKeyboardButton("💳 Pay with Stripe", url=checkout_url)],
-        [InlineKeyboardButton("❌ Cancel", callback_data="cart:view")],
+        [BTN_CANCEL_CART],
     ])
 
     await q.edit_message_text(
@@ -495,38 +721,43 @@ async def stripe_cart_checkout(update, context, total_str):
         f"Total: *${total:.2f}*\n\n"
         f"Complete payment via Stripe:",
         reply_markup=kb,
-        parse_mode="Markdown"
+        parse_mode=_MD
     )
 # ==========================================
 # SINGLE ITEM BUY — UI
 # ==========================================
-async def on_buy(update, context, sku, qty):
+@lru_cache(maxsize=256)
+def _buy_options_kb(sku: str, qty: int, total: float):
+    """Payment-method keyboard; same (sku, qty, total) repeats across buyers."""
+    # FORMAT: pay_native:provider:amount:sku
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("💳 Stripe", callback_data=f"pay_native:stripe:{total}:{sku}:{qty}")],
+        [InlineKeyboardButton("🌐 Smart Glocal", callback_data=f"pay_native:smart_glocal:{total}:{sku}")],
+        [InlineKeyboardButton("🚀 Pay with Solana (SOL)", callback_data=f"pay_crypto:solana:{total:.2f}:{sku}")],
+        [InlineKeyboardButton("🇪🇸 Redsys", callback_data=f"pay_native:redsys:{total:.2f}:{sku}")],
+        [InlineKeyboardButton("🇸🇬 PayNow (HitPay)", callback_data=f"hitpay:{sku}:{qty}")],
+        [InlineKeyboardButton("🔙 Back", callback_data=CB_MENU_SHOP)],
+    ])
+
+async def on_buy(update, context, sku, qty, item=None):
     q = update.callback_query
-    item = get_any_product_by_sku(sku)
+    if item is None:                    # on_checkout resolves it already
+        item = get_any_product_by_sku(sku)
 
     if not item:
         return await q.answer("Item missing", show_alert=True)
 
     qty = clamp_qty(qty)
-    total = float(item["price"]) * qty
+    total = item["price"] * qty
 
-    # FORMAT: pay_native:provider:amount:sku
-    # Fixed syntax: added comma after Solana button and removed extra parentheses
-    kb = InlineKeyboardMarkup([
-        [InlineKeyboardButton("💳 Stripe", callback_data=f"pay_native:stripe:{total}:{sku}:{qty}")],
-        [InlineKeyboardButton("🌐 Smart Glocal", callback_data=f"pay_native:smart_glocal:{total}:{sku}")],
-        [InlineKeyboardButton("🚀 Pay with Solana (SOL)", callback_data=f"pay_crypto:solana:{total:.2f}:{sku}")],
-        [InlineKeyboardButton("🇪🇸 Redsys", callback_data=f"pay_native:redsys:{total:.2f}:{sku}")],
-        [InlineKeyboardButton("🇸🇬 PayNow (HitPay)", callback_data=f"hitpay:{sku}:{qty}")], 
-        [InlineKeyboardButton("🔙 Back", callback_data="menu:shop")],
-    ])
+    kb = _buy_options_kb(sku, qty, total)
 
     txt = (
-        f"{item.get('emoji')} *{item['name']}*\n"
+        f"{item['emoji']} *{item['name']}*\n"
         f"Qty: *{qty}*\nTotal: *SGD {total:.2f}*" 
     )
 
-    await q.edit_message_text(txt, parse_mode="Markdown", reply_markup=kb)
+    await edit_card(q, txt, kb, context=context)
 
 
 # ==========================================
@@ -537,6 +768,10 @@ def clamp_qty(qty, min_qty: int = 1, max_qty: int = 99) -> int:
     Normalizes qty into a safe integer range.
     Accepts int/float/str like "3", "3.0", etc.
     """
+    # fast path: callers mostly pass ints already
+    if type(qty) is int:
+        return min_qty if qty < min_qty else max_qty if qty > max_qty else qty
+
     try:
         q = int(qty)
     except Exception:
@@ -569,28 +804,29 @@ async def on_qty(update, context, sku, qty):
         # Re-clamp to max available stock
         qty = stock_left if stock_left > 0 else 1
 
-    total = float(item["price"]) * qty
+    total = item["price"] * qty
 
     kb = InlineKeyboardMarkup([
         [
-            InlineKeyboardButton("−", callback_data=f"qty:{sku}:{qty-1}"),
+            InlineKeyboardButton("−", callback_data=f"qty:{sku}:{qty}:-1"),
             # 'noop' callback data prevents the button from triggering an error
-            InlineKeyboardButton(f"Qty: {qty}", callback_data="noop"), 
-            InlineKeyboardButton("+", callback_data=f"qty:{sku}:{qty+1}"),
+            InlineKeyboardButton(f"Qty: {qty}", callback_data=CB_NOOP), 
+            InlineKeyboardButton("+", callback_data=f"qty:{sku}:{qty}:1"),
         ],
         [InlineKeyboardButton(f"✅ Checkout — ${total:.2f}", callback_data=f"checkout:{sku}:{qty}")],
-        [InlineKeyboardButton("🔙 Back to Shop", callback_data="menu:shop")],
+        [BTN_BACK_SHOP],
     ])
 
-    await q.edit_message_text(
+    await edit_card(
+        q,
         f"🛒 *Confirm Quantity*\n\n"
-        f"📦 *Product:* {item.get('emoji', '🛍')} {item['name']}\n"
+        f"📦 *Product:* {item['emoji']} {md_escape(item['name'])}\n"
         f"💰 *Price:* `${item['price']:.2f}`\n"
         f"🔢 *Selected:* `{qty}`\n"
         f"══════════════════════\n"
         f"💵 *Total:* `${total:.2f}`",
-        reply_markup=kb,
-        parse_mode="Markdown",
+        kb,
+        context=context,
     )
 
 # ==========================================
@@ -600,7 +836,6 @@ async def on_qty(update, context, sku, qty):
 async def show_captcha(update, context, captcha_text):
     # This generates buttons for a simple captcha
     options = ["123", "ABC", captcha_text, "XYZ"] # Simplified logic
-    import random
     random.shuffle(options)
     
     kb = InlineKeyboardMarkup([
@@ -610,7 +845,7 @@ async def show_captcha(update, context, captcha_text):
     await update.callback_query.edit_message_text(
         "🛡 *Security Verification*\n\nPlease select the correct code to verify you are human:",
         reply_markup=kb,
-        parse_mode="Markdown"
+        parse_mode=_MD
     )
 
 # ==========================================
@@ -619,11 +854,15 @@ async def show_captcha(update, context, captcha_text):
 async def on_checkout(update, context, sku, qty):
     # This redirects the user to the payment method selection screen (on_buy)
     # We re-verify stock one last time before showing payment options
+    item = get_any_product_by_sku(sku)
+    if not item:
+        return await update.callback_query.answer("Item missing", show_alert=True)
+
     ok, stock = inventory.check_stock(sku, qty)
     if not ok:
         return await update.callback_query.answer(f"Out of stock! Only {stock} left.", show_alert=True)
-        
-    return await on_buy(update, context, sku, qty)
+
+    return await on_buy(update, context, sku, qty, item=item)
 
 # ==========================================
 #  Check Order Status in orders.json
@@ -636,7 +875,7 @@ async def handle_start_deep_link(update: Update, context: ContextTypes.DEFAULT_T
         order_id = payload.replace("success_", "")
         
         # 1. Load orders to verify status
-        orders = storage.load_json(storage.ORDERS_FILE)
+        orders = _load_json(storage.ORDERS_FILE)
         order_info = orders.get(order_id)
 
         if order_info and order_info.get("status") == "escrow_hold":
@@ -646,10 +885,7 @@ async def handle_start_deep_link(update: Update, context: ContextTypes.DEFAULT_T
                 "The seller has been notified to fulfill your order. "
                 "Funds will only be released once you confirm receipt."
             )
-            kb = InlineKeyboardMarkup([
-                [InlineKeyboardButton("📦 View Order Status", callback_data="menu:orders")],
-                [InlineKeyboardButton("🏠 Main Menu", callback_data="menu:main")]
-            ])
+            kb = _KB_PAID
         else:
             # If the webhook hasn't arrived yet, show a 'processing' message
             text = (
@@ -658,11 +894,12 @@ async def handle_start_deep_link(update: Update, context: ContextTypes.DEFAULT_T
                 "It may take a moment for the payment provider to notify us. "
                 "Please check your Orders menu in a few seconds."
             )
-            kb = InlineKeyboardMarkup([[InlineKeyboardButton("🔄 Refresh Orders", callback_data="menu:orders")]])
+            kb = _KB_REFRESH_ORDERS
 
         ok, msg = inventory.confirm_payment(order_id)
         if not ok:
-            await update.message.reply_text(f"⚠️ Inventory confirm failed: {msg}", parse_mode="Markdown")
+            # plain text: msg can carry sku underscores that would break Markdown
+            await update.message.reply_text(f"⚠️ Inventory confirm failed: {msg}")
 
 # ==========================================
 # Handle Post Completion
@@ -672,30 +909,29 @@ async def handle_post_completion_dispute(update, context, oid):
     q = update.callback_query
     uid = update.effective_user.id
 
-    # 1. mark disputed
-    storage.update_order_status(oid, "disputed")
+    # 1. mark disputed (local file write; stays on the loop so orders.json
+    #    writers never interleave)
+    _update_status(oid, "disputed")
 
-    # 2. notify admin
-    try:
-        await context.bot.send_message(
+    # 2. admin notice + buyer alert are independent round-trips → overlap them;
+    #    a failed admin send must not block the buyer's ack
+    await asyncio.gather(
+        context.bot.send_message(
             ADMIN_ID,
-            f"🚨 **Post-completion dispute**\n"
+            f"🚨 *Post-completion dispute*\n"
             f"Order: `{oid}`\n"
             f"By user: `{uid}`",
-            parse_mode="Markdown"
-        )
-    except:
-        pass
-
-    await q.answer("⚖️ Dispute filed. An admin will review it.", show_alert=True)
+            parse_mode=_MD
+        ),
+        q.answer("⚖️ Dispute filed. An admin will review it.", show_alert=True),
+        return_exceptions=True,
+    )
     return await on_menu(update, context, force_tab="orders")
 
 # ==========================================
 # STRIPE — SINGLE ITEM
 # ==========================================
 async def create_stripe_checkout(update, context, sku, qty):
-    import requests
-    
     q = update.callback_query
     item = get_any_product_by_sku(sku)
     
@@ -703,7 +939,7 @@ async def create_stripe_checkout(update, context, sku, qty):
         return await q.answer("❌ Item no longer available.", show_alert=True)
 
     qty = clamp_qty(qty)
-    total = float(item["price"]) * qty
+    total = item["price"] * qty
     user_id = update.effective_user.id
 
     # 1) Create order first
@@ -713,29 +949,27 @@ async def create_stripe_checkout(update, context, sku, qty):
         qty=qty,
         amount=total,
         method="stripe_direct",
-        seller_id=int(item.get("seller_id", 0)),
+        seller_id=item["seller_id"],
     )
 
     # 2) Reserve stock
     ok, msg = inventory.reserve_for_payment(order_id, sku, qty)
     if not ok:
-        storage.update_order_status(order_id, "failed", reason=msg)
+        _update_status(order_id, "failed", reason=msg)
         return await q.answer(f"❌ {msg}", show_alert=True)
 
     # 3) Call YOUR server (not Telegram Payments)
     try:
-        SERVER_BASE = os.getenv("SERVER_BASE_URL", "").rstrip("/")
-        if not SERVER_BASE:
+        if not SERVER_BASE_URL:
             raise ValueError("SERVER_BASE_URL not set in .env")
 
-        res = requests.post(
-            f"{SERVER_BASE}/create_checkout_session",
+        res = await _http().post(
+            STRIPE_SESSION_URL,
             json={
                 "order_id": order_id,
                 "user_id": user_id,
                 "amount": total,
             },
-            timeout=15,
         )
         res.raise_for_status()
         data = res.json()
@@ -746,38 +980,36 @@ async def create_stripe_checkout(update, context, sku, qty):
 
     except Exception as e:
         inventory.release_on_failure_or_refund(order_id, reason=f"stripe_create_failed:{e}")
-        storage.update_order_status(order_id, "failed", reason=str(e))
+        _update_status(order_id, "failed", reason=str(e))
         return await q.edit_message_text(f"❌ Stripe error: {e}")
 
     # 4) Show Stripe checkout link
     kb = InlineKeyboardMarkup([
         [InlineKeyboardButton("💳 Pay with Stripe", url=checkout_url)],
-        [InlineKeyboardButton("❌ Cancel", callback_data="menu:shop")],
+        [BTN_CANCEL_SHOP],
     ])
 
-    await q.edit_message_text(
+    await edit_card(
+        q,
         f"💳 *Stripe Checkout*\n\n"
-        f"Item: {item['name']}\n"
+        f"Item: {md_escape(item['name'])}\n"
         f"Qty: {qty}\n"
         f"Total: *${total:.2f}*\n\n"
         f"Click below to complete payment:",
-        reply_markup=kb,
-        parse_mode="Markdown"
+        kb,
     )
 # ==========================================
 # HitPay Checkout - Single Item
 # ==========================================                                                                  
 
 async def create_hitpay_checkout(update, context, sku, qty):
-    import requests
-
     q = update.callback_query
     item = get_any_product_by_sku(sku)
     if not item:
         return await q.answer("❌ Item no longer available.", show_alert=True)
 
     qty = clamp_qty(qty)
-    total = float(item["price"]) * qty
+    total = item["price"] * qty
     user_id = update.effective_user.id
 
     # 1) Create order first and use its id everywhere
@@ -787,31 +1019,29 @@ async def create_hitpay_checkout(update, context, sku, qty):
         qty=qty,
         amount=total,
         method="HitPay",
-        seller_id=int(item.get("seller_id", 0)),
+        seller_id=item["seller_id"],
     )
 
     # 2) Reserve stock now
     ok, msg = inventory.reserve_for_payment(order_id, sku, qty)
     if not ok:
-        storage.update_order_status(order_id, "failed", reason=msg)
+        _update_status(order_id, "failed", reason=msg)
         return await q.answer(f"❌ {msg}", show_alert=True)
 
     try:
-        SERVER_BASE = os.getenv("SERVER_BASE_URL", "").rstrip("/")
-        if not SERVER_BASE:
+        if not SERVER_BASE_URL:
             inventory.release_on_failure_or_refund(order_id, reason="missing_server_base")
-            storage.update_order_status(order_id, "failed", reason="SERVER_BASE_URL missing")
+            _update_status(order_id, "failed", reason="SERVER_BASE_URL missing")
             return await q.edit_message_text("❌ SERVER_BASE_URL not set in .env")
 
-        res = requests.post(
-            f"{SERVER_BASE}/hitpay/create_payment",
+        res = await _http().post(
+            HITPAY_CREATE_URL,
             json={
                 "order_id": order_id,          # IMPORTANT
                 "amount": total,
                 "user_id": user_id,
                 "description": item["name"],
             },
-            timeout=15,
         )
         res.raise_for_status()
         data = res.json()
@@ -822,18 +1052,18 @@ async def create_hitpay_checkout(update, context, sku, qty):
 
     except Exception as e:
         inventory.release_on_failure_or_refund(order_id, reason=f"hitpay_create_failed:{e}")
-        storage.update_order_status(order_id, "failed", reason=str(e))
+        _update_status(order_id, "failed", reason=str(e))
         return await q.edit_message_text(f"❌ HitPay error: {e}")
 
     kb = InlineKeyboardMarkup([
         [InlineKeyboardButton("🇸🇬 Pay with PayNow", url=payment_url)],
-        [InlineKeyboardButton("❌ Cancel", callback_data="menu:shop")],
+        [BTN_CANCEL_SHOP],
     ])
 
-    await q.edit_message_text(
-        f"*HitPay Checkout*\nItem: {item['name']}\nQty: {qty}\nTotal: ${total:.2f}\n\nOrder: `{order_id}`",
-        reply_markup=kb,
-        parse_mode="Markdown",
+    await edit_card(
+        q,
+        f"*HitPay Checkout*\nItem: {md_escape(item['name'])}\nQty: {qty}\nTotal: ${total:.2f}\n\nOrder: `{order_id}`",
+        kb,
     )
 
 
@@ -842,8 +1072,6 @@ async def create_hitpay_checkout(update, context, sku, qty):
 # ==========================================
 
 async def create_hitpay_cart_checkout(update, context, total):
-    import requests
-
     q = update.callback_query
     user_id = update.effective_user.id
     total = float(total)
@@ -853,10 +1081,11 @@ async def create_hitpay_cart_checkout(update, context, total):
     if not cart:
         return await q.answer("Cart is empty.", show_alert=True)
 
+    avail = inventory.get_available_stock_bulk(cart)    # one snapshot for the whole cart
     for sku, item in cart.items():
-        qty = int(item.get("qty", 1) or 1)
-        ok, stock_left = inventory.check_stock(sku, qty)
-        if not ok:
+        qty = max(1, int(item.get("qty", 1) or 1))
+        stock_left = avail[sku] or 0
+        if stock_left < qty:
             return await q.answer(
                 f"❌ {sku}: only {stock_left} left. Reduce quantity first.",
                 show_alert=True
@@ -877,20 +1106,18 @@ async def create_hitpay_cart_checkout(update, context, total):
     # (Optional: implement per-item reservation logic here)
 
     try:
-        SERVER_BASE = os.getenv("SERVER_BASE_URL", "").rstrip("/")
-        if not SERVER_BASE:
-            storage.update_order_status(order_id, "failed", reason="SERVER_BASE_URL missing")
+        if not SERVER_BASE_URL:
+            _update_status(order_id, "failed", reason="SERVER_BASE_URL missing")
             return await q.edit_message_text("❌ SERVER_BASE_URL not set in .env")
 
-        res = requests.post(
-            f"{SERVER_BASE}/hitpay/create_payment",
+        res = await _http().post(
+            HITPAY_CREATE_URL,
             json={
                 "order_id": order_id,          # IMPORTANT
                 "amount": total,
                 "user_id": user_id,
                 "description": "Cart Checkout",
             },
-            timeout=15,
         )
         res.raise_for_status()
         data = res.json()
@@ -900,38 +1127,72 @@ async def create_hitpay_cart_checkout(update, context, total):
             raise Exception(f"Invalid HitPay response: {data}")
 
     except Exception as e:
-        storage.update_order_status(order_id, "failed", reason=str(e))
+        _update_status(order_id, "failed", reason=str(e))
         return await q.edit_message_text(f"❌ HitPay error: {e}")
 
     kb = InlineKeyboardMarkup([
         [InlineKeyboardButton("🇸🇬 Pay with HitPay", url=payment_url)],
-        [InlineKeyboardButton("❌ Cancel", callback_data="cart:view")],
+        [BTN_CANCEL_CART],
     ])
 
     await q.edit_message_text(
         f"*HitPay Cart Checkout*\nTotal: ${total:.2f}\n\nOrder: `{order_id}`",
         reply_markup=kb,
-        parse_mode="Markdown",
+        parse_mode=_MD,
     )
 
 # ==========================================
 # FUNCTIONS PANEL  (your original)
 # ==========================================
+_BTN_FUNCTIONS = InlineKeyboardButton("🏠 Functions", callback_data=CB_MENU_FUNCTIONS)
+
+# static panel → one markup for everyone
+_KB_FUNCTIONS = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📊 Disputes (Admin)", callback_data="admin:disputes")],
+    [BTN_HOME]
+])
+
 async def show_functions_menu(update, context):
     q = update.callback_query
-    kb = InlineKeyboardMarkup([
-        [InlineKeyboardButton("📊 Disputes (Admin)", callback_data="admin:disputes")],
-        [InlineKeyboardButton("🏠 Home", callback_data="menu:main")]
-    ])
-    await q.edit_message_text(
-        "⚙️ *Functions Panel*\nAdmin tools + utilities.",
-        reply_markup=kb,
-        parse_mode="Markdown"
-    )
+    # same panel re-tapped → skip the no-op edit
+    await edit_card(q, "⚙️ *Functions Panel*\nAdmin tools + utilities.", _KB_FUNCTIONS, context=context)
 
 # ==========================================
 # Admin Dispute Dashboard  (links from Functions)
 # ==========================================
+# rendered dashboard for one parse of orders.json; any status change goes
+# through save_json → new parse object → rebuilt on the next open
+_DISPUTES_RENDER = {"orders": None, "view": None}
+
+def _dispute_dashboard_view():
+    """(text, kb) for the first 10 open disputes, or None when there are none."""
+    orders = storage.load_json_cached(storage.ORDERS_FILE)   # dict  ord_id -> dict
+    if _DISPUTES_RENDER["orders"] is orders:
+        return _DISPUTES_RENDER["view"]
+
+    # stop scanning once the first 10 are found
+    shown = list(islice((o for o in orders.values() if o.get("status") == "disputed"), 10))
+    view = None
+    if shown:
+        lines = ["⚖️ *Open Disputes*"]
+        lines.extend(
+            f"\n`{o['id']}`\n"
+            f"💰 ${float(o['amount']):.2f}  ┊  📦 {md_escape(o.get('item', 'Item'))}\n"
+            f"👤 Buyer `{o['buyer_id']}`  ┊  🏪 Seller `{o['seller_id']}`"
+            for o in shown
+        )
+        buttons = [
+            [InlineKeyboardButton(f"✅ Release {o['id']}", callback_data=f"admin_release:{o['id']}"),
+             InlineKeyboardButton(f"💰 Refund {o['id']}",  callback_data=f"admin_refund:{o['id']}"),
+             InlineKeyboardButton("💬 Chat",              callback_data=f"chat:order:{o['id']}")]
+            for o in shown
+        ]
+        buttons.append([_BTN_FUNCTIONS])
+        view = ("\n".join(lines), InlineKeyboardMarkup(buttons))
+
+    _DISPUTES_RENDER.update(orders=orders, view=view)
+    return view
+
 async def admin_dispute_dashboard(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     uid = update.effective_user.id
@@ -939,43 +1200,66 @@ async def admin_dispute_dashboard(update: Update, context: ContextTypes.DEFAULT_
     if uid != ADMIN_ID:
         return await q.answer("🚫 Access Denied", show_alert=True)
 
-    orders = storage.load_json(storage.ORDERS_FILE)          # dict  ord_id -> dict
-    disputes = [o for o in orders.values() if o.get("status") == "disputed"]
+    view = _dispute_dashboard_view()
+    if view is None:
+        return await q.edit_message_text("✅ No open disputes.", reply_markup=KB_JUST_HOME)
 
-    if not disputes:
-        kb = InlineKeyboardMarkup([[InlineKeyboardButton("🏠 Home", callback_data="menu:main")]])
-        return await q.edit_message_text("✅ No open disputes.", reply_markup=kb)
+    text, kb = view
+    await q.edit_message_text(text, parse_mode=_MD, reply_markup=kb)
 
-    lines   = ["⚖️ *Open Disputes*"]
-    buttons = []
+async def _settle_dispute(update, context, oid, new_status, buyer_note, seller_note):
+    q = update.callback_query
+    if update.effective_user.id != ADMIN_ID:
+        return await q.answer("🚫 Access Denied", show_alert=True)
 
-    for o in disputes[:10]:          # cap at 10
-        oid   = o["id"]
-        buyer = o["buyer_id"]
-        seller= o["seller_id"]
-        amt   = float(o["amount"])
-        sku   = o.get("item", "Item")
-
-        lines.append(
-            f"\n`{oid}`\n"
-            f"💰 ${amt:.2f}  ┊  📦 {sku}\n"
-            f"👤 Buyer `{buyer}`  ┊  🏪 Seller `{seller}`"
-        )
+    o = storage.load_json_cached(storage.ORDERS_FILE).get(oid)
+    if not o or o.get("status") != "disputed":
+        # already settled (double tap / second admin screen) → just redraw
+        return await admin_dispute_dashboard(update, context)
 
-        buttons.append([
-            InlineKeyboardButton(f"✅ Release {oid}", callback_data=f"admin_release:{oid}"),
-            InlineKeyboardButton(f"💰 Refund {oid}",  callback_data=f"admin_refund:{oid}"),
-            InlineKeyboardButton(f"💬 Chat",         callback_data=f"chat:order:{oid}")
-        ])
+    if new_status == "refunded":
+        inventory.release_on_failure_or_refund(oid, reason="refunded")
+    _update_status(oid, new_status, reason="admin_dispute")
+
+    await asyncio.gather(
+        context.bot.send_message(o["buyer_id"], buyer_note.format(oid=oid), parse_mode=_MD),
+        context.bot.send_message(o["seller_id"], seller_note.format(oid=oid), parse_mode=_MD),
+        return_exceptions=True,
+    )
+    return await admin_dispute_dashboard(update, context)
+
+async def admin_release(update: Update, context: ContextTypes.DEFAULT_TYPE, oid: str):
+    """Close a dispute in the seller's favour: order completes, funds go to the seller."""
+    return await _settle_dispute(
+        update, context, oid, "completed",
+        "⚖️ Dispute on order `{oid}` closed: funds released to the seller.",
+        "⚖️ Dispute on order `{oid}` closed in your favour: funds released.",
+    )
 
-    buttons.append([InlineKeyboardButton("🏠 Functions", callback_data="menu:functions")])
-    kb = InlineKeyboardMarkup(buttons)
-    await q.edit_message_text("\n".join(lines), parse_mode="Markdown", reply_markup=kb)   
+async def admin_refund(update: Update, context: ContextTypes.DEFAULT_TYPE, oid: str):
+    """Close a dispute in the buyer's favour: order refunded, reserved stock returned."""
+    return await _settle_dispute(
+        update, context, oid, "refunded",
+        "⚖️ Dispute on order `{oid}` closed: you are being refunded.",
+        "⚖️ Dispute on order `{oid}` closed: the buyer was refunded.",
+    )
 
 
 # ==========================================
 # MENU ROUTER
 # ==========================================
+# order status → emoji for the Orders tab
+_STATUS_EMOJI = {
+    "pending": "⏳", "awaiting_payment": "⏳", "escrow_hold": "🔒",
+    "shipped": "🚚", "completed": "✅", "disputed": "⚖️",
+    "refunded": "💰", "cancelled": "❌", "expired": "🕰",
+}
+_ORDERS_FOOTER = [
+    InlineKeyboardButton("🔄 Refresh", callback_data=CB_MENU_ORDERS),
+    InlineKeyboardButton("🏠 Main Menu", callback_data="menu:orders:main"),
+]
+ORDERS_SHOWN = 12
+
 def _safe_int(v, default=0):
     try:
         return int(v)
@@ -999,25 +1283,28 @@ def _safe_float(v, default=0.0):
 
 async def on_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, force_tab: str = None):
     q = update.callback_query
-    _, tab = q.data.split(":", 1)
+    # callers like chat / dispute flows pass force_tab from a non-menu callback
+    tab = force_tab or q.data.partition(":")[2]
     uid = update.effective_user.id
 
     # ---------- helper ----------
     async def safe_edit(text, kb):
-        try:
-            return await q.edit_message_text(text, reply_markup=kb, parse_mode="Markdown")
-        except Exception as e:
-            logger.warning("safe_edit: %s – sending fresh message", e)
-            return await context.bot.send_message(
-                uid, text, reply_markup=kb, parse_mode="Markdown"
-            )
-
-    # ---------- emoji quick-map ----------
-    emoji = {
-        "pending": "⏳", "awaiting_payment": "⏳", "escrow_hold": "🔒",
-        "shipped": "🚚", "completed": "✅", "disputed": "⚖️",
-        "refunded": "💰", "cancelled": "❌", "expired": "🕰",
-    }
+        # photo cards can't become a text menu → go straight to a fresh message
+        if not q.message.photo:
+            if _same_render(context, q, text, kb):
+                return None
+            try:
+                res = await q.edit_message_text(text, reply_markup=kb, parse_mode=_MD)
+                _remember_render(context, q, text)
+                return res
+            except BadRequest as e:
+                # same screen re-tapped → nothing to send
+                if "not modified" in str(e).lower():
+                    return None
+                logger.warning("safe_edit: %s – sending fresh message", e)
+        return await context.bot.send_message(
+            uid, text, reply_markup=kb, parse_mode=_MD
+        )
 
     # =========================================================================
     #  SHOP
@@ -1048,12 +1335,7 @@ async def on_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, force_tab:
         on_chain      = balances[curr_network]              # primary balance
         network_emoji = "🌍" if curr_network == "mainnet" else "🧪"
 
-        kb = InlineKeyboardMarkup([
-            [InlineKeyboardButton("📥 Deposit / View Address", callback_data="wallet:deposit")],
-            [InlineKeyboardButton("📤 Withdraw SOL",          callback_data="wallet:withdraw")],
-            [InlineKeyboardButton("🔧 Network Info",         callback_data="wallet:network")],
-            [InlineKeyboardButton("🏠 Home",                  callback_data="menu:main")]
-        ])
+        kb = _WALLET_KB
 
         text = (
             f"💼 **Wallet Dashboard**\n\n"
@@ -1069,20 +1351,28 @@ async def on_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, force_tab:
     # =========================================================================
     #  MESSAGES
     # =========================================================================
-    if tab == "messages":
-        threads = storage.load_json(storage.MESSAGES_FILE)
-        buttons = []
-        for k, v in threads.items():
-            if uid in (v.get("buyer_id"), v.get("seller_id")) and uid not in v.get("hidden_from", []):
-                name = v.get("product", {}).get("name", "Chat")
-                buttons.append([
-                    InlineKeyboardButton(f"💬 {name}", callback_data=f"chat:open:{k}"),
-                    InlineKeyboardButton("🗑", callback_data=f"chat:delete:{k}")
-                ])
-        buttons.append([InlineKeyboardButton("🏠 Home", callback_data="menu:main")])
-        msg_text = "💌 *Your Conversations*\n" + "━" * 15 + "\n"
-        if len(buttons) == 1:
-            msg_text += "_No active messages._"
+    if tab == "messages" or tab.startswith("messages:"):
+        # menu:messages:<page>; only one page of threads gets buttons
+        try:
+            page = max(0, int(tab.partition(":")[2] or 0))
+        except ValueError:
+            page = 0
+        # mtime-cached per-user (thread id, name) rows → no thread dicts touched
+        threads = storage.threads_for_user(uid)
+        start = page * MESSAGES_PAGE_SIZE
+        buttons = [
+            [InlineKeyboardButton(f"💬 {name}", callback_data=f"chat:open:{k}"),
+             InlineKeyboardButton("🗑", callback_data=f"chat:delete:{k}")]
+            for k, name in threads[start:start + MESSAGES_PAGE_SIZE]
+        ]
+        has_chats = bool(threads)
+        if len(threads) > MESSAGES_PAGE_SIZE:
+            buttons.append(_pager("menu:messages:", page, start + MESSAGES_PAGE_SIZE < len(threads)))
+        buttons.append([BTN_HOME])
+        parts = ["💌 *Your Conversations*\n", "━" * 15, "\n"]
+        if not has_chats:
+            parts.append("_No active messages._")
+        msg_text = "".join(parts)
         return await safe_edit(msg_text, InlineKeyboardMarkup(buttons))
 
     # =========================================================================
@@ -1093,23 +1383,18 @@ async def on_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, force_tab:
         orders = storage.list_orders_for_user(uid)
         if not orders:
             txt = "📦 *Orders*\n\n_No orders yet._"
-            kb = InlineKeyboardMarkup([
-                [InlineKeyboardButton("🔄 Refresh", callback_data="menu:orders"),
-                 InlineKeyboardButton("🏠 Home", callback_data="menu:main")]
-            ])
-            return await safe_edit(txt, kb)
-
-        orders = sorted(orders, key=lambda o: int(o.get("ts", 0)), reverse=True)
-        lines, buttons = ["📦 *Your Order History*"], []
-
-        for o in orders[:12]:
-            oid   = o.get("id", "???")
-            item  = o.get("item", "Product")
-            qty   = o.get("qty", 1)
-            amt   = float(o.get("amount", 0))
-            stat  = str(o.get("status", "pending")).lower()
-            lines.append(f"{emoji.get(stat, '❓')} `{oid}`  {item} ×{qty}  ‑  *${amt:.2f}*")
+            return await safe_edit(txt, _KB_NO_ORDERS)
+
+        # rows arrive newest-first from storage
+        shown = orders[:ORDERS_SHOWN]
+        txt = "📦 *Your Order History*\n" + "\n".join(
+            f"{_STATUS_EMOJI.get(o.status, '❓')} `{o.id}`  {md_escape(o.item)} ×{o.qty}  ‑  *${o.amount:.2f}*"
+            for o in shown
+        )
 
+        buttons = []
+        for o in shown:
+            oid, stat = o.id, o.status
             row = [InlineKeyboardButton("💬 Chat", callback_data=f"chat:order:{oid}")]
             if stat in ("pending", "awaiting_payment"):
                 row.append(InlineKeyboardButton("❌ Cancel", callback_data=f"ordercancel:{oid}"))
@@ -1122,7 +1407,7 @@ async def on_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, force_tab:
             buttons.append(row)
 
             # seller extras
-            if int(o.get("seller_id", 0)) == uid:
+            if o.seller_id == uid:
                 s_row = []
                 if stat == "escrow_hold":
                     s_row.append(InlineKeyboardButton("📦 Ship", callback_data=f"seller:ship:{oid}"))
@@ -1131,11 +1416,8 @@ async def on_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, force_tab:
                 if s_row:
                     buttons.append(s_row)
 
-        buttons.append([
-            InlineKeyboardButton("🔄 Refresh", callback_data="menu:orders"),
-            InlineKeyboardButton("🏠 Main Menu", callback_data="menu:orders:main")
-        ])
-        return await safe_edit("\n".join(lines), InlineKeyboardMarkup(buttons))
+        buttons.append(_ORDERS_FOOTER)
+        return await safe_edit(txt, InlineKeyboardMarkup(buttons))
 
     # =========================================================================
     #  SELL
@@ -3,11 +3,13 @@ import base58
 import json
 import os
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Optional, Union
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.constants import ParseMode
 from telegram.ext import ContextTypes
+from modules.buttons import BTN_HOME
 
 # ---------- Solana ----------
 from solana.rpc.api import Client
@@ -29,6 +31,9 @@ devnet_client  = Client(SOLANA_DEVNET_RPC)
 mainnet_client = Client(SOLANA_MAINNET_RPC)
 solana_client  = Client(SOLANA_RPC_URL)
 
+# shared pool so independent RPC round-trips can overlap
+_RPC_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="solana-rpc")
+
 WALLETS_FILE   = "wallets.json"
 WITHDRAW_STATE: Dict[int, dict] = {}
 
@@ -40,7 +45,16 @@ def create_wallet() -> Dict[str, str]:
     kp = Keypair()
     return {"public_key": str(kp.pubkey()), "private_key": base58.b58encode(bytes(kp)).decode()}
 
+# keypairs never change once created and wallets.json is only written
+# below, so each user's wallet is read from disk at most once per process
+_WALLET_CACHE: Dict[str, Dict[str, str]] = {}
+
 def ensure_user_wallet(user_id: int) -> Dict[str, str]:
+    uid = str(user_id)
+    hit = _WALLET_CACHE.get(uid)
+    if hit is not None:
+        return hit
+
     os.makedirs(os.path.dirname(WALLETS_FILE) or ".", exist_ok=True)
     if not os.path.exists(WALLETS_FILE):
         with open(WALLETS_FILE, "w") as f:
@@ -49,12 +63,12 @@ def ensure_user_wallet(user_id: int) -> Dict[str, str]:
     with open(WALLETS_FILE, "r") as f:
         data: dict = json.load(f)
 
-    uid = str(user_id)
     if uid not in data:
         data[uid] = create_wallet()
         with open(WALLETS_FILE, "w") as f:
             json.dump(data, f, indent=2)
 
+    _WALLET_CACHE[uid] = data[uid]
     return data[uid]
 
 # ---------- balances ----------
@@ -68,7 +82,10 @@ def get_balance(pubkey: str, network: Optional[str] = None) -> float:
         return 0.0
 
 def get_balance_both(pubkey: str) -> Dict[str, float]:
-    return {"devnet": get_balance(pubkey, "devnet"), "mainnet": get_balance(pubkey, "mainnet")}
+    # both networks in flight at once → latency is max(RTT), not the sum
+    dev  = _RPC_POOL.submit(get_balance, pubkey, "devnet")
+    main = _RPC_POOL.submit(get_balance, pubkey, "mainnet")
+    return {"devnet": dev.result(), "mainnet": main.result()}
 
 def get_balance_devnet(pubkey: str) -> float:
     return get_balance(pubkey, "devnet")
@@ -93,7 +110,7 @@ async def show_sol_address(update: Update, context: ContextTypes.DEFAULT_TYPE):
     kb = InlineKeyboardMarkup([
         [InlineKeyboardButton("📤 Withdraw", callback_data="wallet:withdraw"),
          InlineKeyboardButton("🔧 Network", callback_data="wallet:network")],
-        [InlineKeyboardButton("🏠 Home", callback_data="menu:main")]
+        [BTN_HOME]
     ])
     await q.edit_message_text(text, reply_markup=kb, parse_mode=ParseMode.MARKDOWN, disable_web_page_preview=True)
 
@@ -1,8 +1,9 @@
+import asyncio
 import os
 import pathlib
 from time import time
 from dotenv import load_dotenv
-import requests
+import httpx
 import json
 import logging
 
@@ -19,7 +20,7 @@ load_dotenv(BASE_DIR / ".env")
 # ============================================================
 # 🔑 ENV VARS
 # ============================================================
-PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "").strip()
+PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "").strip().rstrip("/")
 
 STRIPE_SECRET_KEY = os.getenv("STRIPE_SECRET_KEY", "").strip()
 STRIPE_WEBHOOK_SECRET = os.getenv("STRIPE_WEBHOOK_SECRET", "").strip()
@@ -28,7 +29,7 @@ HITPAY_API_KEY = os.getenv("HITPAY_API_KEY", "").strip()
 HITPAY_API_BASE = os.getenv(
     "HITPAY_API_BASE",
     "https://api.sandbox.hit-pay.com/v1"
-).strip()
+).strip().rstrip("/")
 
 if not HITPAY_API_KEY:
     raise RuntimeError("HITPAY_API_KEY missing in .env")
@@ -51,6 +52,30 @@ if not HITPAY_API_KEY:
 
 stripe.api_key = STRIPE_SECRET_KEY
 
+# URL prefixes are fixed by env → build them once, handlers only append the id
+SUCCESS_URL_PREFIX = f"{PUBLIC_BASE_URL}/payment/success?order_id="
+CANCEL_URL_PREFIX = f"{PUBLIC_BASE_URL}/payment/cancel?order_id="
+HITPAY_WEBHOOK_URL = f"{PUBLIC_BASE_URL}/hitpay/webhook"
+HITPAY_PAYMENT_REQUESTS_URL = f"{HITPAY_API_BASE}/payment-requests"
+
+# one keep-alive client for HitPay: TLS handshake once, not per payment.
+# async, so it's only ever used from the event loop (a requests.Session
+# shared across to_thread workers isn't thread-safe). the auth headers
+# never change, so they live on the client
+_HITPAY_HTTP = None
+
+def _hitpay_http() -> httpx.AsyncClient:
+    global _HITPAY_HTTP
+    if _HITPAY_HTTP is None:
+        _HITPAY_HTTP = httpx.AsyncClient(
+            timeout=15,
+            headers={
+                "X-BUSINESS-API-KEY": HITPAY_API_KEY,
+                "Content-Type": "application/json",
+            },
+        )
+    return _HITPAY_HTTP
+
 # ============================================================
 # 📂 FILES
 # ============================================================
@@ -64,6 +89,13 @@ app = FastAPI()
 logging.basicConfig(level=logging.INFO)
 log = logging.getLogger("server")
 
+@app.on_event("shutdown")
+async def _close_hitpay_http():
+    global _HITPAY_HTTP
+    if _HITPAY_HTTP is not None:
+        await _HITPAY_HTTP.aclose()
+        _HITPAY_HTTP = None
+
 # ============================================================
 # 🧠 JSON HELPERS
 # ============================================================
@@ -228,23 +260,13 @@ async def hitpay_create_payment(request: Request):
         "amount": round(float(amount), 2),
         "currency": "SGD",
         "reference_number": order_id,
-        "redirect_url": f"{PUBLIC_BASE_URL}/payment/success?order_id={order_id}",
-        "webhook_url": f"{PUBLIC_BASE_URL}/hitpay/webhook",
+        "redirect_url": SUCCESS_URL_PREFIX + str(order_id),
+        "webhook_url": HITPAY_WEBHOOK_URL,
         "purpose": f"Order {order_id}",
     }
 
-    headers = {
-        "X-BUSINESS-API-KEY": HITPAY_API_KEY,
-        "Content-Type": "application/json",
-    }
-
     try:
-        r = requests.post(
-            f"{HITPAY_API_BASE}/payment-requests",
-            json=payload,
-            headers=headers,
-            timeout=15,
-        )
+        r = await _hitpay_http().post(HITPAY_PAYMENT_REQUESTS_URL, json=payload)
         r.raise_for_status()
         data = r.json()
 
@@ -276,7 +298,9 @@ async def create_checkout_session(request: Request):
         # Stripe expects integers in cents
         amount_cents = int(round(float(amount) * 100))
 
-        session = stripe.checkout.Session.create(
+        # stripe's client is blocking HTTP → keep it off the event loop
+        session = await asyncio.to_thread(
+            stripe.checkout.Session.create,
             payment_method_types=["card"],
             mode="payment",
             line_items=[{
@@ -287,8 +311,8 @@ async def create_checkout_session(request: Request):
                 },
                 "quantity": 1,
             }],
-            success_url=f"{PUBLIC_BASE_URL}/payment/success?order_id={order_id}",
-            cancel_url=f"{PUBLIC_BASE_URL}/payment/cancel?order_id={order_id}",
+            success_url=SUCCESS_URL_PREFIX + str(order_id),
+            cancel_url=CANCEL_URL_PREFIX + str(order_id),
             metadata={
                 "order_id": str(order_id),
                 "user_id": str(user_id),